@@ -0,0 +1,9 @@
+import os
+import sys
+
+# 讓 `python -m app` 也能像直接執行 app/ 底下的腳本一樣匯入同一層的模組
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from cli import main
+
+sys.exit(main())
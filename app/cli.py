@@ -0,0 +1,299 @@
+import os
+import sys
+import glob
+import argparse
+
+# 這個檔案只匯入標準函式庫。各功能模組 (以及它們背後的 SDK) 都在子指令真正執行時才載入，
+# 讓 `python -m app --help` 或只用到其中一項功能時都能快速啟動。
+
+
+def expand_paths(patterns, suffix=".mp3"):
+    """
+    把命令列給的路徑展開成檔案列表：支援 glob (含 **)，給資料夾時會遞迴找出底下的原始 mp3。
+    結果依字母排序並去除重複。
+    """
+    from dedup_index import is_original_mp3
+
+    paths = []
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            for root, dirs, files in os.walk(pattern):
+                dirs[:] = [d for d in dirs if not d.startswith(".")]
+                paths.extend(os.path.join(root, f) for f in files if is_original_mp3(f))
+            continue
+        matches = glob.glob(pattern, recursive=True)
+        if not matches:
+            print(f"⚠️ 警告：'{pattern}' 沒有符合的檔案。")
+        paths.extend(m for m in matches if os.path.isfile(m) and m.endswith(suffix))
+    return sorted(set(paths))
+
+
+def _transcript_path(path):
+    """analyze 可以直接給逐字稿，也可以給音檔 (對應的逐字稿為 <音檔>.json)。"""
+    return path if path.endswith(".json") else path + ".json"
+
+
+def _run_batch(paths, step, label):
+    """依序處理每個檔案，最後印出摘要；有任何失敗時回傳 1 作為結束碼。"""
+    if not paths:
+        print("❌ 錯誤：沒有任何要處理的檔案。")
+        return 1
+    from dedup_index import relink_duplicates
+    failures = []
+    for i, path in enumerate(paths):
+        print(f"\n=== ({i + 1}/{len(paths)}) {label}：{path} ===")
+        if not step(path):
+            failures.append(path)
+            continue
+        # 這一集若是其他重複集數的正本，把剛產生的檔案也連結過去
+        relink_duplicates(path[:-len(".json")] if path.endswith(".mp3.json") else path)
+    print(f"\n📊 完成 {len(paths) - len(failures)}/{len(paths)} 個檔案。")
+    for path in failures:
+        print(f"  ❌ {path}")
+    return 1 if failures else 0
+
+
+# --- 各階段 ---
+
+def _transcribe_output(path, backend):
+    if backend == "groq":
+        return os.path.splitext(path)[0] + ".txt"
+    return path + ".json"
+
+
+def _transcribe_done(path, backend):
+    if backend == "groq":
+        return os.path.exists(_transcribe_output(path, backend))
+    # 串流轉錄被中斷時會留下半份 .json 與 .inprogress 標記，這種不算完成
+    from run_whisper_cpp import is_transcript_complete
+    return is_transcript_complete(_transcribe_output(path, backend))
+
+
+def _transcribe_one(path, args):
+    if not args.force and _transcribe_done(path, args.backend):
+        print("✅ 已有逐字稿，跳過。")
+        return True
+
+    if args.backend == "groq":
+        from groq_api import transcribe_with_groq
+        return transcribe_with_groq(path)
+    if args.backend == "stream":
+        from stream_transcribe import stream_transcribe_file
+        return stream_transcribe_file(path, model_size=args.model)
+
+    from run_whisper_cpp import transcribe_with_whisper_cpp, auto_transcribe_with_whisper_cpp
+    model_size = args.model
+    if model_size == "auto":
+        deadline_sec = args.deadline * 60 if args.deadline else None
+        result = auto_transcribe_with_whisper_cpp(path, deadline_sec=deadline_sec)
+        if result is not None:
+            return result
+        print("ℹ️ 尚未校準過這台主機，改用 base 模型。")
+        model_size = "base"
+    return transcribe_with_whisper_cpp(path, model_size)
+
+
+def _analyze_one(path, args):
+    transcript_path = _transcript_path(path)
+    if not os.path.exists(transcript_path):
+        print(f"❌ 錯誤：找不到逐字稿 '{transcript_path}'。")
+        return False
+    # 已有分析結果時仍然呼叫：分析器會比對逐字稿，只把有變動的時間格送給 Gemini，沒變動就不花任何 API 呼叫
+    from google_API import analyze_transcript_with_google_api
+    return analyze_transcript_with_google_api(transcript_path, force=args.force)
+
+
+def _compress_one(path, args):
+    from compress_mp3 import compress_to_target_size
+    return compress_to_target_size(path, target_mb=args.target_mb)
+
+
+def _cut_one(path, args):
+    output_path = os.path.splitext(path)[0] + ".ad_free.mp3"
+    analysis_path = path + ".analysis.json"
+    if not args.force and os.path.exists(output_path):
+        # 增量重新分析可能改了廣告時段，分析結果比去廣告版本新的時候要重新剪輯
+        if not os.path.exists(analysis_path) or os.path.getmtime(analysis_path) <= os.path.getmtime(output_path):
+            print("✅ 已有去廣告版本，跳過。")
+            return True
+        print("🔄 分析結果比去廣告版本新，重新剪輯。")
+    from cut_ads import cut_ads
+    return cut_ads(path)
+
+
+def _pipeline_one(path, args):
+    """單集的完整流程：轉錄 → 分析 → 剪輯，已經完成的階段會自動跳過。"""
+    if not _transcribe_one(path, args):
+        return False
+    if not _analyze_one(path, args):
+        return False
+    if args.skip_cut:
+        return True
+    return _cut_one(path, args)
+
+
+# --- 子指令 ---
+
+def cmd_download(args):
+    from podcast_downloader import download_podcast
+    paths = download_podcast(args.rss_url, num_to_download=args.limit,
+                             stream_mode=args.stream, model_size=args.model)
+    return 0 if paths is not None else 1
+
+
+def cmd_transcribe(args):
+    return _run_batch(expand_paths(args.paths), lambda p: _transcribe_one(p, args), "轉錄")
+
+
+def cmd_analyze(args):
+    paths = expand_paths(args.paths, suffix="")
+    paths = [p for p in paths if p.endswith((".mp3", ".json")) and not p.endswith((".analysis.json", ".ads.json"))]
+    return _run_batch(paths, lambda p: _analyze_one(p, args), "分析")
+
+
+def cmd_compress(args):
+    return _run_batch(expand_paths(args.paths), lambda p: _compress_one(p, args), "壓縮")
+
+
+def cmd_cut(args):
+    return _run_batch(expand_paths(args.paths), lambda p: _cut_one(p, args), "剪輯")
+
+
+def cmd_pipeline(args):
+    paths = expand_paths(args.paths)
+    if args.rss:
+        from podcast_downloader import download_podcast
+        downloaded = download_podcast(args.rss, num_to_download=args.limit,
+                                      stream_mode=args.backend == "stream", model_size=args.model)
+        if downloaded is None:
+            return 1
+        paths = sorted(set(paths) | set(downloaded))
+    status = _run_batch(paths, lambda p: _pipeline_one(p, args), "完整流程")
+    from storage_manager import enforce_storage_budget
+    enforce_storage_budget(quiet=True)
+    return status
+
+
+def cmd_daemon(args):
+    from subscription_daemon import run_daemon
+    if not os.path.exists(args.subscriptions):
+        print(f"❌ 錯誤：找不到訂閱清單 '{args.subscriptions}'。")
+        return 1
+    run_daemon(args.subscriptions)
+    return 0
+
+
+def cmd_queue(args):
+    from work_queue import main as queue_main
+    return queue_main(args.queue_args)
+
+
+def cmd_calibrate(args):
+    from whisper_tuning import calibrate
+    return 0 if calibrate(args.sample, clip_sec=args.clip_sec) else 1
+
+
+def cmd_storage(args):
+    from storage_manager import enforce_storage_budget
+    enforce_storage_budget(dry_run=args.dry_run)
+    return 0
+
+
+def cmd_dedup_index(args):
+    from dedup_index import index_existing_library
+    print(f"✅ 已將 {index_existing_library()} 集既有節目登記到去重索引。")
+    return 0
+
+
+def _add_transcribe_options(parser, backends=("whisper", "stream", "groq")):
+    help_text = {
+        "whisper": "whisper：本機 whisper.cpp 整檔轉錄",
+        "stream": "stream：分段視窗轉錄",
+        "groq": "groq：Groq 雲端 API (只輸出純文字 .txt)",
+    }
+    parser.add_argument("--backend", choices=list(backends), default="whisper",
+                        help="；".join(help_text[b] for b in backends))
+    parser.add_argument("--model", default="auto",
+                        help="whisper.cpp 模型 (tiny/base/small/medium...)，auto 表示依校準結果自動選擇")
+    parser.add_argument("--deadline", type=float, help="每集希望在幾分鐘內轉錄完成 (搭配 --model auto)")
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        prog="python -m app",
+        description="Podcast AI 處理器：下載、轉錄、分析、壓縮與剪輯廣告。",
+    )
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("download", help="從 RSS Feed 下載節目")
+    p.add_argument("rss_url")
+    p.add_argument("-n", "--limit", type=int, help="只下載最新的幾集 (預設全部)")
+    p.add_argument("--stream", action="store_true", help="邊下載邊用 whisper.cpp 轉錄")
+    p.add_argument("--model", default="base", help="--stream 使用的 whisper.cpp 模型，可用 auto")
+    p.set_defaults(func=cmd_download)
+
+    p = sub.add_parser("transcribe", help="轉錄音檔 (可給路徑、glob 或資料夾)")
+    p.add_argument("paths", nargs="+")
+    _add_transcribe_options(p)
+    p.add_argument("--force", action="store_true", help="已有逐字稿也重新轉錄")
+    p.set_defaults(func=cmd_transcribe)
+
+    p = sub.add_parser("analyze", help="用 Gemini 分析逐字稿中的廣告時段 (可給音檔或 .json)")
+    p.add_argument("paths", nargs="+")
+    p.add_argument("--force", action="store_true", help="忽略上次的分析結果，整份逐字稿重新分析")
+    p.set_defaults(func=cmd_analyze)
+
+    p = sub.add_parser("compress", help="壓縮音檔到目標大小")
+    p.add_argument("paths", nargs="+")
+    p.add_argument("--target-mb", type=float, default=24.5)
+    p.set_defaults(func=cmd_compress)
+
+    p = sub.add_parser("cut", help="依分析結果剪掉廣告，輸出 .ad_free.mp3")
+    p.add_argument("paths", nargs="+")
+    p.add_argument("--force", action="store_true", help="去廣告版本比分析結果新也重新剪輯")
+    p.set_defaults(func=cmd_cut)
+
+    p = sub.add_parser("pipeline", help="轉錄 → 分析 → 剪輯，已完成的階段會跳過")
+    p.add_argument("paths", nargs="*")
+    p.add_argument("--rss", help="先從這個 RSS Feed 下載，再處理下載到的集數")
+    p.add_argument("-n", "--limit", type=int, help="搭配 --rss，只下載最新的幾集")
+    # groq 只回傳沒有時間戳記的純文字，無法交給 Gemini 分析出廣告時段，所以完整流程不提供
+    _add_transcribe_options(p, backends=("whisper", "stream"))
+    p.add_argument("--skip-cut", action="store_true", help="只轉錄與分析，不剪輯")
+    p.add_argument("--force", action="store_true", help="每個階段都重新執行")
+    p.set_defaults(func=cmd_pipeline)
+
+    p = sub.add_parser("daemon", help="依訂閱清單持續輪詢所有節目")
+    p.add_argument("subscriptions", nargs="?", default="subscriptions.json")
+    p.set_defaults(func=cmd_daemon)
+
+    p = sub.add_parser("queue", help="多節點工作佇列 (enqueue / worker / status)")
+    p.add_argument("queue_args", nargs=argparse.REMAINDER)
+    p.set_defaults(func=cmd_queue)
+
+    p = sub.add_parser("calibrate", help="量測本機各 whisper.cpp 模型與 -t/-p 設定的速度")
+    p.add_argument("sample", help="用來校準的音檔")
+    p.add_argument("--clip-sec", type=int, default=60)
+    p.set_defaults(func=cmd_calibrate)
+
+    p = sub.add_parser("storage", help="依 podcast_downloads/.storage.json 的容量上限與保留規則清理檔案")
+    p.add_argument("--dry-run", action="store_true", help="只列出會刪除的檔案")
+    p.set_defaults(func=cmd_storage)
+
+    p = sub.add_parser("dedup-index", help="把既有的集數補登記到去重索引")
+    p.set_defaults(func=cmd_dedup_index)
+
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    try:
+        return args.func(args) or 0
+    except KeyboardInterrupt:
+        print("\n👋 已中斷。")
+        return 130
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,5 +1,4 @@
 import os
-from pydub import AudioSegment
 
 def select_any_mp3_file():
     """
@@ -37,6 +36,7 @@ def select_any_mp3_file():
 def compress_to_target_size(input_path, target_mb=24.5, min_bitrate_kbps=32):
     """
     智慧壓縮音檔，使其大小約等於目標大小。
+    成功 (或不需要壓縮) 時回傳 True。
     """
     if not input_path:
         return
@@ -54,11 +54,12 @@ def compress_to_target_size(input_path, target_mb=24.5, min_bitrate_kbps=32):
         # 1. 檢查是否需要壓縮
         if original_size_bytes <= limit_bytes:
             print(f"✅ 檔案大小未超過 {target_mb}MB，無需壓縮。")
-            return
+            return True
 
         print(f"⚠️ 檔案大小超過 {target_mb}MB，開始進行智慧壓縮...")
         
         # 2. 載入音檔並計算所需位元速率
+        from pydub import AudioSegment
         audio = AudioSegment.from_mp3(input_path)
         duration_sec = len(audio) / 1000.0
         
@@ -87,6 +88,7 @@ def compress_to_target_size(input_path, target_mb=24.5, min_bitrate_kbps=32):
         print("\n🎉 壓縮完成！")
         print(f"   新檔案大小: {compressed_size_mb:.2f} MB")
         print(f"💾 新檔案已儲存至: {output_path}")
+        return True
 
     except Exception as e:
         print(f"❌ 壓縮過程中發生錯誤: {e}")
@@ -0,0 +1,122 @@
+import os
+import json
+
+
+def select_analyzed_mp3_file():
+    """
+    提供互動式選單，從所有已經有 .analysis.json 分析結果的原始 MP3 中選擇一集。
+    """
+    base_dir = "podcast_downloads"
+    if not os.path.exists(base_dir) or not os.listdir(base_dir):
+        print(f"❌ 錯誤：找不到 '{base_dir}' 資料夾，或資料夾為空。")
+        return None
+
+    candidates = []
+    for root, dirs, files in os.walk(base_dir):
+        dirs[:] = [d for d in dirs if not d.startswith(".")]
+        for file in files:
+            if file.endswith(".mp3") and os.path.exists(os.path.join(root, file + ".analysis.json")):
+                candidates.append(os.path.relpath(os.path.join(root, file), base_dir))
+
+    if not candidates:
+        print("❌ 錯誤：找不到任何已分析過廣告時段的 .mp3 檔案。")
+        return None
+
+    print("\n--- 請選擇要剪掉廣告的 MP3 檔案 ---")
+    for i, file_path in enumerate(candidates[:30]):
+        print(f"[{i + 1}] {file_path}")
+    try:
+        choice = int(input("> 請輸入數字選擇檔案: "))
+        return os.path.join(base_dir, candidates[choice - 1])
+    except (ValueError, IndexError):
+        print("❌ 選擇無效。")
+        return None
+
+
+def load_ad_intervals(analysis_path):
+    """讀取 .analysis.json 的廣告時段，回傳排序並合併重疊後的 [(start, end)] 列表 (秒)。"""
+    with open(analysis_path, 'r', encoding='utf-8') as f:
+        ads = json.load(f).get("ads", [])
+
+    intervals = []
+    for ad in ads:
+        try:
+            start, end = float(ad["start_time"]), float(ad["end_time"])
+        except (KeyError, TypeError, ValueError):
+            continue
+        if end > start:
+            intervals.append((max(start, 0.0), end))
+
+    merged = []
+    for start, end in sorted(intervals):
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def cut_ads(audio_path, analysis_path=None):
+    """
+    依照 AI 分析出的廣告時段，把廣告剪掉並輸出成 "<原檔名>.ad_free.mp3"。
+    成功時回傳 True。
+    """
+    if not audio_path:
+        return
+
+    analysis_path = analysis_path or audio_path + ".analysis.json"
+    if not os.path.exists(analysis_path):
+        print(f"❌ 錯誤：找不到分析結果 '{analysis_path}'。")
+        return False
+
+    try:
+        intervals = load_ad_intervals(analysis_path)
+    except (OSError, json.JSONDecodeError) as e:
+        print(f"❌ 讀取分析結果時發生錯誤: {e}")
+        return False
+
+    base_name, ext = os.path.splitext(audio_path)
+    output_path = f"{base_name}.ad_free{ext}"
+
+    print("\n--- 正在剪輯 ---")
+    print(f"原始檔案: {audio_path}")
+    print(f"廣告時段: {len(intervals)} 段")
+
+    try:
+        from pydub import AudioSegment
+        audio = AudioSegment.from_mp3(audio_path)
+
+        # 保留廣告與廣告之間的片段
+        kept = AudioSegment.empty()
+        cursor_ms = 0
+        removed_ms = 0
+        for start, end in intervals:
+            start_ms, end_ms = int(start * 1000), min(int(end * 1000), len(audio))
+            if start_ms >= len(audio):
+                break
+            kept += audio[cursor_ms:start_ms]
+            removed_ms += end_ms - start_ms
+            cursor_ms = end_ms
+        kept += audio[cursor_ms:]
+
+        print(f"✂️ 共剪掉 {removed_ms / 1000:.2f} 秒，匯出中...")
+        # 先匯出到同一個資料夾的暫存檔再改名，匯出失敗時不會留下看起來已完成的半個 .ad_free.mp3
+        tmp_path = f"{output_path}.{os.getpid()}.tmp"
+        try:
+            kept.export(tmp_path, format="mp3")
+            os.replace(tmp_path, output_path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        print(f"💾 去廣告版本已儲存至: {output_path}")
+        return True
+
+    except Exception as e:
+        print(f"❌ 剪輯過程中發生錯誤: {e}")
+        return False
+
+
+if __name__ == "__main__":
+    file_to_cut = select_analyzed_mp3_file()
+    if file_to_cut:
+        cut_ads(file_to_cut)
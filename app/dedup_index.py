@@ -0,0 +1,341 @@
+import os
+import json
+import hashlib
+import socket
+import threading
+from contextlib import contextmanager
+
+import requests
+
+from file_lock import locked_file
+from storage_manager import classify
+
+# 去重索引：用 RSS <guid>、音檔網址與「快速內容雜湊」辨識同一集節目，
+# 不論標題被修改、換了日期或出現在別的 Feed，都能找到已經下載與處理過的檔案。
+BASE_DIR = "podcast_downloads"
+INDEX_FILE = os.path.join(BASE_DIR, ".dedup_index.json")
+HASH_PART_BYTES = 1024 * 1024  # 快速雜湊只讀頭尾各 1MB
+
+
+def _hash_parts(size, head, tail):
+    h = hashlib.sha256()
+    h.update(str(size).encode())
+    h.update(head)
+    h.update(tail)
+    return h.hexdigest()
+
+
+def quick_file_hash(path):
+    """以「檔案大小 + 前 1MB + 後 1MB」計算雜湊，不必讀完整個檔案。"""
+    size = os.path.getsize(path)
+    with open(path, 'rb') as f:
+        head = f.read(HASH_PART_BYTES)
+        if size <= HASH_PART_BYTES:
+            tail = head
+        else:
+            f.seek(size - HASH_PART_BYTES)
+            tail = f.read(HASH_PART_BYTES)
+    return _hash_parts(size, head, tail)
+
+
+def _remote_size(url):
+    try:
+        response = requests.head(url, allow_redirects=True, timeout=15)
+        response.raise_for_status()
+        return int(response.headers["Content-Length"])
+    except (requests.exceptions.RequestException, KeyError, ValueError):
+        return None
+
+
+def _remote_range(url, start, end):
+    response = requests.get(url, headers={"Range": f"bytes={start}-{end}"}, timeout=30)
+    response.raise_for_status()
+    if response.status_code != 206:
+        # 伺服器不支援 Range，放棄遠端雜湊
+        return None
+    return response.content
+
+
+def quick_remote_hash(url, size):
+    """用兩次 HTTP Range 請求算出與 quick_file_hash 相同的雜湊，伺服器不支援時回傳 None。"""
+    try:
+        head = _remote_range(url, 0, min(size, HASH_PART_BYTES) - 1)
+        if head is None:
+            return None
+        if size <= HASH_PART_BYTES:
+            tail = head
+        else:
+            tail = _remote_range(url, size - HASH_PART_BYTES, size - 1)
+            if tail is None:
+                return None
+    except requests.exceptions.RequestException:
+        return None
+    return _hash_parts(size, head, tail)
+
+
+def is_original_mp3(file_name):
+    """與 compress_mp3.py 相同的規則：原始檔不是壓縮過或剪輯過的版本。"""
+    return (file_name.endswith(".mp3") and not file_name.startswith("compressed_")
+            and not file_name.endswith(".compressed.mp3") and not file_name.endswith(".ad_free.mp3"))
+
+
+def find_episode_artifacts(mp3_path):
+    """
+    找出由某一集原始 mp3 衍生出來的所有檔案 (逐字稿、分析結果、壓縮檔、去廣告版本...)，
+    回傳檔名列表 (不含原始 mp3 本身)。
+    依 storage_manager.classify 的已知後綴比對集數名稱，不能只比對開頭，
+    否則 "Ep 1.mp3" 會把同資料夾 "Ep 1.5.mp3" 的逐字稿也當成自己的。
+    """
+    folder = os.path.dirname(mp3_path)
+    name = os.path.basename(mp3_path)
+    stem = os.path.splitext(name)[0]
+    file_names = set(os.listdir(folder or "."))
+    artifacts = []
+    for file_name in sorted(file_names):
+        if file_name == name:
+            continue
+        episode, stage = classify(file_name)
+        # .tmp、.inprogress 等不認得的檔案 classify 會回傳 None
+        if episode != stem or stage in (None, "original"):
+            continue
+        # 還在轉錄中的逐字稿先不連結，等完成後由 relink_duplicates 補上
+        if file_name + ".inprogress" in file_names:
+            continue
+        artifacts.append(file_name)
+    return artifacts
+
+
+def link_duplicate(canonical_path, new_path):
+    """
+    讓 new_path 指向已存在的 canonical_path：原始 mp3 與所有衍生檔案都建立相對路徑的符號連結，
+    後續流程會看到逐字稿、分析結果都已經存在，不會重做。
+    """
+    canonical_stem = os.path.splitext(os.path.basename(canonical_path))[0]
+    new_stem = os.path.splitext(os.path.basename(new_path))[0]
+    canonical_dir = os.path.dirname(canonical_path)
+    new_dir = os.path.dirname(new_path)
+    os.makedirs(new_dir or ".", exist_ok=True)
+
+    pairs = [(os.path.basename(canonical_path), os.path.basename(new_path))]
+    for artifact in find_episode_artifacts(canonical_path):
+        if artifact.startswith("compressed_"):
+            pairs.append((artifact, f"compressed_{os.path.basename(new_path)}"))
+        else:
+            pairs.append((artifact, new_stem + artifact[len(canonical_stem):]))
+
+    for source_name, target_name in pairs:
+        target = os.path.join(new_dir, target_name)
+        if os.path.lexists(target):
+            continue
+        source = os.path.relpath(os.path.join(canonical_dir, source_name), new_dir or ".")
+        os.symlink(source, target)
+
+
+class DedupIndex:
+    """
+    索引結構：{"episodes": {相對路徑: {"guids": [[節目資料夾, guid], ...], "urls": [...], "hash": ..., "size": ...,
+                                        "duplicates": [...], "removed": ...}}}
+    以 podcast_downloads 內的相對路徑當作每一集的「正本」，duplicates 是連結到它的重複集數；
+    removed 由 storage_manager.py 設定，表示原始檔 ("original") 或整集 ("episode") 已被清掉。
+    RSS 的 guid 只保證在同一個 Feed 裡唯一 (很多節目直接用 "123"、"episode-1")，所以一律連同節目資料夾一起比對。
+    """
+
+    def __init__(self, path=INDEX_FILE, base_dir=BASE_DIR):
+        self.path = path
+        self.base_dir = base_dir
+        self.episodes = {}
+        self._rebuild_lookups()
+
+    def _rebuild_lookups(self):
+        self.by_guid = {}
+        self.by_url = {}
+        self.by_hash = {}
+        self.sizes = set()
+        for rel_path, entry in self.episodes.items():
+            for guid in entry.get("guids", []):
+                # 舊版索引只存 guid 字串，視為屬於正本自己所在的節目
+                scope, guid = guid if isinstance(guid, list) else (os.path.dirname(rel_path), guid)
+                self.by_guid[(scope, guid)] = rel_path
+            for url in entry.get("urls", []):
+                self.by_url[url] = rel_path
+            if entry.get("hash"):
+                self.by_hash[entry["hash"]] = rel_path
+            if entry.get("size"):
+                self.sizes.add(entry["size"])
+
+    def load(self):
+        if os.path.exists(self.path):
+            try:
+                with open(self.path, 'r', encoding='utf-8') as f:
+                    self.episodes = json.load(f).get("episodes", {})
+            except (OSError, json.JSONDecodeError):
+                print(f"⚠️ 警告：無法讀取去重索引 '{self.path}'，將重新建立。")
+                self.episodes = {}
+        self._rebuild_lookups()
+        return self
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp_path = f"{self.path}.{socket.gethostname()}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({"episodes": self.episodes}, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.path)
+
+    @contextmanager
+    def locked(self):
+        """跨行程 (與 NFS 上的其他節點) 互斥地「讀取 → 修改 → 寫回」索引。"""
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with locked_file(self.path + ".lock"):
+            self.load()
+            yield self
+            self.save()
+
+    def abs_path(self, rel_path):
+        return os.path.join(self.base_dir, rel_path)
+
+    def guid_key(self, episode_path, guid):
+        """guid 在索引中的鍵：(這一集所在的節目資料夾, guid)。"""
+        if not guid:
+            return None
+        return (os.path.relpath(os.path.dirname(os.path.abspath(episode_path)), os.path.abspath(self.base_dir)), guid)
+
+    def lookup(self, guid_key=None, url=None, content_hash=None):
+        """依 guid (限同一個節目) → 網址 → 內容雜湊的順序尋找正本，找不到回傳 None。"""
+        for key, table in ((guid_key, self.by_guid), (url, self.by_url), (content_hash, self.by_hash)):
+            if key and key in table:
+                return table[key]
+        return None
+
+    def record(self, path, guid_key=None, url=None, content_hash=None, size=None, duplicate=None):
+        rel_path = os.path.relpath(path, self.base_dir)
+        entry = self.episodes.setdefault(rel_path, {"guids": [], "urls": []})
+        if duplicate:
+            duplicate_rel = os.path.relpath(duplicate, self.base_dir)
+            if duplicate_rel not in entry.setdefault("duplicates", []):
+                entry["duplicates"].append(duplicate_rel)
+        if guid_key and list(guid_key) not in entry["guids"]:
+            entry["guids"].append(list(guid_key))
+        if url and url not in entry["urls"]:
+            entry["urls"].append(url)
+        if content_hash:
+            entry["hash"] = content_hash
+        if size:
+            entry["size"] = size
+        self._rebuild_lookups()
+        return rel_path
+
+
+def resolve_before_download(url, save_path, guid=None):
+    """
+    下載前先查索引。若這一集其實已經有了 (同 guid、同網址，或遠端頭尾內容雜湊相同)，
+    就把 save_path 連結到既有的正本與其衍生檔案並回傳 True，不需要再下載。
+    """
+    index = DedupIndex().load()
+    guid_key = index.guid_key(save_path, guid)
+    canonical = index.lookup(guid_key=guid_key, url=url)
+
+    if canonical is None and index.sizes:
+        # 先用 HEAD 看大小，只有大小與索引中某一集相同時才值得再抓頭尾各 1MB
+        size = _remote_size(url)
+        if size and size in index.sizes:
+            canonical = index.lookup(content_hash=quick_remote_hash(url, size))
+
+    if canonical is None:
+        return False
+    if index.episodes[canonical].get("removed"):
+        # 已經被空間管理刪除的集數，不要再下載回來
+        print(f"  🗑️ 這一集已因空間管理被移除 ({canonical})，跳過。")
+        return True
+    canonical_path = index.abs_path(canonical)
+    if not os.path.exists(canonical_path) or os.path.abspath(canonical_path) == os.path.abspath(save_path):
+        return False
+
+    link_duplicate(canonical_path, save_path)
+    with index.locked():
+        index.record(canonical_path, guid_key=guid_key, url=url, duplicate=save_path)
+    print(f"  🔗 與既有集數重複，已連結至：{canonical}")
+    return True
+
+
+def register_download(url, save_path, guid=None):
+    """
+    下載完成後登記到索引。若內容雜湊與既有的另一集相同 (例如伺服器不支援 Range 而無法事先比對)，
+    就把剛下載的檔案換成指向正本的連結，至少省下後續的轉錄與分析。
+    """
+    content_hash = quick_file_hash(save_path)
+    size = os.path.getsize(save_path)
+    index = DedupIndex()
+    guid_key = index.guid_key(save_path, guid)
+    with index.locked():
+        canonical = index.lookup(content_hash=content_hash)
+        canonical_path = index.abs_path(canonical) if canonical else None
+        if (canonical_path and os.path.exists(canonical_path)
+                and os.path.abspath(canonical_path) != os.path.abspath(save_path)):
+            index.record(canonical_path, guid_key=guid_key, url=url, duplicate=save_path)
+        else:
+            index.record(save_path, guid_key=guid_key, url=url, content_hash=content_hash, size=size)
+            return False
+
+    os.remove(save_path)
+    link_duplicate(canonical_path, save_path)
+    print(f"  🔗 內容與既有集數相同，已改為連結至：{canonical}")
+    return True
+
+
+def relink_duplicates(episode_path, base_dir=BASE_DIR):
+    """
+    正本多了新的衍生檔案 (逐字稿、分析結果、去廣告版本...) 之後，幫所有重複集數補上對應的連結。
+    每個階段完成後呼叫；episode_path 不是任何重複集數的正本時什麼都不做。回傳處理的重複集數數量。
+    """
+    index = DedupIndex(path=os.path.join(base_dir, os.path.basename(INDEX_FILE)), base_dir=base_dir).load()
+    entry = index.episodes.get(os.path.relpath(episode_path, base_dir))
+    if not entry:
+        return 0
+    count = 0
+    for duplicate in entry.get("duplicates", []):
+        duplicate_path = index.abs_path(duplicate)
+        # 已經被刪掉或換成獨立檔案的就不再管它
+        if not os.path.islink(duplicate_path):
+            continue
+        link_duplicate(episode_path, duplicate_path)
+        count += 1
+    return count
+
+
+def index_existing_library(base_dir=BASE_DIR):
+    """
+    把已經下載好的集數補登記到索引 (只有內容雜湊，guid 與網址會在下次遇到時補上)，
+    並把指向正本的符號連結登記為重複集數，順便補齊它們缺少的衍生檔案連結。
+    """
+    index = DedupIndex(path=os.path.join(base_dir, os.path.basename(INDEX_FILE)), base_dir=base_dir)
+    count = 0
+    with index.locked():
+        known = set(index.episodes)
+        links = []
+        for root, dirs, files in os.walk(base_dir):
+            dirs[:] = [d for d in dirs if not d.startswith(".")]
+            for file_name in files:
+                path = os.path.join(root, file_name)
+                if not is_original_mp3(file_name):
+                    continue
+                if os.path.islink(path):
+                    links.append(path)
+                    continue
+                if os.path.relpath(path, base_dir) in known:
+                    continue
+                index.record(path, content_hash=quick_file_hash(path), size=os.path.getsize(path))
+                count += 1
+        for path in links:
+            canonical_path = os.path.realpath(path)
+            canonical = os.path.relpath(canonical_path, os.path.realpath(base_dir))
+            if canonical in index.episodes:
+                index.record(index.abs_path(canonical), duplicate=path)
+
+    for canonical, entry in index.episodes.items():
+        if entry.get("duplicates"):
+            relink_duplicates(index.abs_path(canonical), base_dir=base_dir)
+    return count
+
+
+if __name__ == "__main__":
+    print(f"✅ 已將 {index_existing_library()} 集既有節目登記到去重索引。")
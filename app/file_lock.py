@@ -0,0 +1,56 @@
+import os
+import threading
+from contextlib import contextmanager
+
+# 跨行程的檔案鎖：POSIX (含 NFS) 用 fcntl.lockf；Windows 沒有 fcntl，改用 msvcrt 鎖住鎖檔的第一個位元組。
+# fcntl 的鎖屬於整個行程，同一行程的其他執行緒拿得到同一把鎖 (關掉任何一個 fd 還會把鎖整個放掉)，
+# 所以外面再包一層每個鎖檔一把的 threading.Lock，讓同一行程內也互斥。
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+    import msvcrt
+
+
+_thread_locks = {}
+_thread_locks_guard = threading.Lock()
+
+
+def _thread_lock(lock_path):
+    key = os.path.abspath(lock_path)
+    with _thread_locks_guard:
+        return _thread_locks.setdefault(key, threading.Lock())
+
+
+def _lock(lock_file):
+    if fcntl is not None:
+        fcntl.lockf(lock_file, fcntl.LOCK_EX)
+        return
+    lock_file.seek(0)
+    while True:
+        try:
+            msvcrt.locking(lock_file.fileno(), msvcrt.LK_LOCK, 1)
+            return
+        except OSError:
+            # LK_LOCK 重試約 10 秒還拿不到就會丟出例外，繼續等
+            continue
+
+
+def _unlock(lock_file):
+    if fcntl is not None:
+        fcntl.lockf(lock_file, fcntl.LOCK_UN)
+        return
+    lock_file.seek(0)
+    msvcrt.locking(lock_file.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+@contextmanager
+def locked_file(lock_path):
+    """在 lock_path 上取得獨佔鎖 (跨行程也跨執行緒)，離開 with 區塊時釋放。"""
+    with _thread_lock(lock_path):
+        with open(lock_path, 'a+') as lock_file:
+            _lock(lock_file)
+            try:
+                yield
+            finally:
+                _unlock(lock_file)
@@ -1,8 +1,11 @@
 import os
 import json
-import google.generativeai as genai
+import hashlib
 from dotenv import load_dotenv
 
+# 逐字稿以固定長度的時間格為單位分析與快取，重新分析時只送出內容有變動的時間格
+WINDOW_SEC = 300
+
 def select_json_file():
     """
     提供一個互動式選單，讓使用者選擇要分析的 .json 逐字稿檔案。
@@ -41,87 +44,228 @@ def select_json_file():
     return os.path.join(podcast_path, selected_file)
 
 
-def analyze_transcript_with_google_api(json_transcript_path):
+def load_segments(json_transcript_path):
+    """
+    讀取逐字稿，回傳 [{"start", "end", "text"}] 列表。
+    同時支援 segment 列表格式，以及 whisper-cli -oj 輸出的 {"transcription": [...]} 格式。
+    """
+    with open(json_transcript_path, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    if isinstance(data, dict) and "transcription" in data:
+        # whisper-cli 的 offsets 單位是毫秒
+        return [
+            {
+                "start": item["offsets"]["from"] / 1000.0,
+                "end": item["offsets"]["to"] / 1000.0,
+                "text": item["text"].strip(),
+            } for item in data["transcription"]
+        ]
+    return data
+
+
+def build_prompt(transcript_text):
+    """組出要送給 Gemini 的完整 Prompt。"""
+    # ★★★ 全新的、更穩健的 Prompt 組合方式 ★★★
+    # 我們將指令拆成一個列表，再用換行符號組合起來，以避免多行字串的語法錯誤。
+    prompt_lines = [
+        '你是一位專業的 Podcast 分析師，你的唯一任務是根據使用者提供的逐字稿，找出廣告時段，並以純粹的 JSON 格式回傳結果。',
+        '',
+        '你的回覆**必須**是一個 JSON 物件，該物件只有一個名為 "ads" 的 key，其 value 是一個陣列。',
+        "陣列中的每個物件都代表一個廣告時段，並包含 'start_time' (秒), 'end_time' (秒), 和 'reason' (簡短原因)。",
+        '如果沒有廣告，"ads" 的 value 必須是一個空陣列 `[]`。',
+        '',
+        '### 範例輸出 (EXAMPLE OUTPUT) ###',
+        '```json',
+        '{',
+        '  "ads": [',
+        '    {',
+        '      "start_time": 1.50,',
+        '      "end_time": 97.00,',
+        '      "reason": "由 Sharp 贊助，介紹新品家電。"',
+        '    }',
+        '  ]',
+        '}',
+        '```',
+        '**重要提醒：絕對不要在你的回覆中包含任何 JSON 以外的文字、解釋或 markdown 格式。你的輸出必須能被直接解析成 JSON。**',
+        '',
+        '--- 逐字稿開始 ---',
+        transcript_text,
+        '--- 逐字稿結束 ---'
+    ]
+    return "\n".join(prompt_lines)
+    # ★★★★★★★★★★★★★★★★★★★★★★★★★★★★★★★★★★★
+
+
+def build_windows(segments, window_sec=WINDOW_SEC):
+    """
+    依 segment 的開始時間把逐字稿切到固定的時間格 (第 i 格為 [i*window_sec, (i+1)*window_sec))，
+    並對每一格的文字與時間戳記計算雜湊。時間格固定不動，所以重新轉錄時沒改到的段落雜湊也不會變。
+    """
+    windows = {}
+    for seg in segments:
+        index = int(seg['start'] // window_sec)
+        windows.setdefault(index, []).append(seg)
+
+    result = []
+    for index in sorted(windows):
+        # 時間戳記也要算進去：文字相同但時間位移了 (例如修正 offset 後重新轉錄)，沿用舊的廣告時段會剪錯地方。
+        # 文字忽略空白差異，時間取到 0.1 秒
+        text = "\n".join(f"{seg['start']:.1f}-{seg['end']:.1f} " + " ".join(seg['text'].split()) for seg in windows[index])
+        result.append({
+            "index": index,
+            "start": index * window_sec,
+            # 最後一句可能跨過格線，時間格的結尾延伸到該句結束，廣告才不會被切掉一截
+            "end": max((index + 1) * window_sec, max(seg['end'] for seg in windows[index])),
+            "hash": hashlib.sha256(text.encode('utf-8')).hexdigest(),
+            "segments": windows[index],
+        })
+    return result
+
+
+def _group_runs(windows):
+    """把變動的時間格依是否相鄰分組，相鄰的一起送出，減少 API 呼叫次數。"""
+    runs = []
+    for window in windows:
+        if runs and runs[-1][-1]["index"] + 1 == window["index"]:
+            runs[-1].append(window)
+        else:
+            runs.append([window])
+    return runs
+
+
+def _clip_ads_to_window(ads, window):
+    """把廣告時段切到單一時間格的範圍內，之後才能一格一格替換。"""
+    clipped = []
+    for ad in ads:
+        try:
+            start, end = float(ad['start_time']), float(ad['end_time'])
+        except (KeyError, TypeError, ValueError):
+            continue
+        start, end = max(start, window["start"]), min(end, window["end"])
+        if end > start:
+            clipped.append({"start_time": round(start, 2), "end_time": round(end, 2), "reason": ad.get('reason', '')})
+    return clipped
+
+
+def merge_window_ads(windows):
+    """把各時間格的廣告片段接回來：相連 (間隔 1 秒內) 的片段合併成同一段廣告。"""
+    pieces = sorted((ad for w in windows for ad in w["ads"]), key=lambda ad: ad["start_time"])
+    merged = []
+    for ad in pieces:
+        if merged and ad["start_time"] - merged[-1]["end_time"] <= 1.0:
+            merged[-1]["end_time"] = max(merged[-1]["end_time"], ad["end_time"])
+        else:
+            merged.append(dict(ad))
+    return merged
+
+
+def _load_previous_windows(output_json_path, window_sec):
+    """讀取上次分析存下的時間格；格式不符 (例如舊版分析結果) 時回傳空字典，代表全部重做。"""
+    if not os.path.exists(output_json_path):
+        return {}
+    try:
+        with open(output_json_path, 'r', encoding='utf-8') as f:
+            previous = json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return {}
+    if previous.get("window_sec") != window_sec:
+        return {}
+    return {w["index"]: w for w in previous.get("windows", [])}
+
+
+def _request_ads(model, transcript_text):
+    """送出一次分析請求，回傳 AI 找到的廣告列表。"""
+    response = model.generate_content(build_prompt(transcript_text))
+    result_content = response.text
+
+    if result_content.startswith("```json"):
+        result_content = result_content.strip("```json\n").strip("```")
+
+    print("--- AI 回傳的原始結果 ---")
+    print(result_content)
+    return json.loads(result_content).get('ads', [])
+
+
+def analyze_transcript_with_google_api(json_transcript_path, force=False):
     """
     使用 Google AI Studio 的原生 API 來分析逐字稿 JSON 檔案。
+    結果中會記錄每個時間格的文字雜湊；重新執行時只把內容有變動的時間格送給 Gemini，
+    其餘沿用上次的結果。force=True 則全部重新分析。成功時回傳 True。
     """
     if not json_transcript_path:
         return
         
     try:
-        with open(json_transcript_path, 'r', encoding='utf-8') as f:
-            segments = json.load(f)
-        transcript_text = "\n".join([f"[{s['start']:.2f}s - {s['end']:.2f}s] {s['text']}" for s in segments])
+        segments = load_segments(json_transcript_path)
     except Exception as e:
         print(f"❌ 讀取或解析 JSON 檔案時發生錯誤: {e}")
         return
 
-    load_dotenv()
-    google_api_key = os.getenv("GOOGLE_API_KEY")
-    if not google_api_key:
-        print("❌ 錯誤：請在 .env 檔案中設定 GOOGLE_API_KEY")
-        return
+    base_filename = os.path.splitext(json_transcript_path)[0]
+    output_json_path = base_filename + ".analysis.json"
 
-    try:
-        genai.configure(api_key=google_api_key)
-        model = genai.GenerativeModel("gemini-2.0-flash")
-
-        # ★★★ 全新的、更穩健的 Prompt 組合方式 ★★★
-        # 我們將指令拆成一個列表，再用換行符號組合起來，以避免多行字串的語法錯誤。
-        prompt_lines = [
-            '你是一位專業的 Podcast 分析師，你的唯一任務是根據使用者提供的逐字稿，找出廣告時段，並以純粹的 JSON 格式回傳結果。',
-            '',
-            '你的回覆**必須**是一個 JSON 物件，該物件只有一個名為 "ads" 的 key，其 value 是一個陣列。',
-            "陣列中的每個物件都代表一個廣告時段，並包含 'start_time' (秒), 'end_time' (秒), 和 'reason' (簡短原因)。",
-            '如果沒有廣告，"ads" 的 value 必須是一個空陣列 `[]`。',
-            '',
-            '### 範例輸出 (EXAMPLE OUTPUT) ###',
-            '```json',
-            '{',
-            '  "ads": [',
-            '    {',
-            '      "start_time": 1.50,',
-            '      "end_time": 97.00,',
-            '      "reason": "由 Sharp 贊助，介紹新品家電。"',
-            '    }',
-            '  ]',
-            '}',
-            '```',
-            '**重要提醒：絕對不要在你的回覆中包含任何 JSON 以外的文字、解釋或 markdown 格式。你的輸出必須能被直接解析成 JSON。**',
-            '',
-            '--- 逐字稿開始 ---',
-            transcript_text,
-            '--- 逐字稿結束 ---'
-        ]
-        full_prompt = "\n".join(prompt_lines)
-        # ★★★★★★★★★★★★★★★★★★★★★★★★★★★★★★★★★★★
+    windows = build_windows(segments)
+    by_index = {w["index"]: w for w in windows}
+    previous = {} if force else _load_previous_windows(output_json_path, WINDOW_SEC)
+    changed = []
+    for w in windows:
+        if previous.get(w["index"], {}).get("hash") == w["hash"]:
+            w["ads"] = previous[w["index"]]["ads"]
+        else:
+            changed.append(w)
 
-        print("\n🤖 正在將逐字稿發送給 Google Gemini 進行分析，請稍候...")
+    print(f"\n🧮 共 {len(windows)} 個時間格，其中 {len(changed)} 個有變動需要重新分析。")
+    if changed:
+        load_dotenv()
+        google_api_key = os.getenv("GOOGLE_API_KEY")
+        if not google_api_key:
+            print("❌ 錯誤：請在 .env 檔案中設定 GOOGLE_API_KEY")
+            return
 
-        response = model.generate_content(full_prompt)
-        result_content = response.text
+    try:
+        if changed:
+            # google.generativeai 載入很慢，只在真的要呼叫 Gemini 時才匯入
+            import google.generativeai as genai
+            genai.configure(api_key=google_api_key)
+            model = genai.GenerativeModel("gemini-2.0-flash")
 
-        if result_content.startswith("```json"):
-            result_content = result_content.strip("```json\n").strip("```")
+        for run in _group_runs(changed):
+            # 前後各多送一個沒變動的時間格當作上下文，跨過格線的廣告才看得完整；結果仍只切回有變動的時間格
+            context_before = by_index.get(run[0]["index"] - 1)
+            context_after = by_index.get(run[-1]["index"] + 1)
+            context_windows = ([context_before] if context_before else []) + run + ([context_after] if context_after else [])
+            run_segments = [seg for w in context_windows for seg in w["segments"]]
+            transcript_text = "\n".join([f"[{s['start']:.2f}s - {s['end']:.2f}s] {s['text']}" for s in run_segments])
+            print(f"\n🤖 正在將 {run[0]['start']:.0f}s - {run[-1]['end']:.0f}s 的逐字稿發送給 Google Gemini 進行分析，請稍候...")
+            run_ads = _request_ads(model, transcript_text)
+            for w in run:
+                w["ads"] = _clip_ads_to_window(run_ads, w)
 
-        print("\n✅ Gemini 分析完成！")
-        print("--- AI 回傳的原始結果 ---")
-        print(result_content)
+        if changed:
+            print("\n✅ Gemini 分析完成！")
+        else:
+            print("\n✅ 逐字稿沒有變動，沿用既有的分析結果。")
 
-        ad_segments_obj = json.loads(result_content)
-        base_filename = os.path.splitext(json_transcript_path)[0]
-        output_json_path = base_filename + ".analysis.json"
-        with open(output_json_path, 'w', encoding='utf-8') as f:
-            json.dump(ad_segments_obj, f, ensure_ascii=False, indent=4)
-        print(f"\n💾 AI 分析結果已儲存至：{output_json_path}")
+        ad_segments = merge_window_ads(windows)
+        # 完全沒變動時不改寫檔案，分析結果的修改時間才能拿來判斷去廣告版本是否需要重新剪輯；
+        # 逐字稿沒有任何片段時 changed 與 previous 都是空的，第一次分析仍要寫出 (空的) 結果檔
+        if changed or force or set(previous) != set(by_index) or not os.path.exists(output_json_path):
+            ad_segments_obj = {
+                "ads": ad_segments,
+                "window_sec": WINDOW_SEC,
+                "windows": [{k: w[k] for k in ("index", "start", "end", "hash", "ads")} for w in windows],
+            }
+            with open(output_json_path, 'w', encoding='utf-8') as f:
+                json.dump(ad_segments_obj, f, ensure_ascii=False, indent=4)
+            print(f"\n💾 AI 分析結果已儲存至：{output_json_path}")
         
-        ad_segments = ad_segments_obj.get('ads', [])
         print("\n--- 解析後的廣告時段 ---")
         if ad_segments:
             for ad in ad_segments:
                 print(f"發現廣告：從 {ad.get('start_time', 'N/A')} 秒 到 {ad.get('end_time', 'N/A')} 秒，原因：{ad.get('reason', 'N/A')}")
         else:
             print("分析結果為：未發現廣告。")
+        return True
             
     except json.JSONDecodeError:
         print("\n⚠️ 警告：AI 回傳的內容不是有效的 JSON 格式。")
@@ -1,6 +1,5 @@
 import os
 import time
-import groq # ★ 匯入新的 groq 函式庫
 from dotenv import load_dotenv
 
 def select_mp3_file():
@@ -41,7 +40,8 @@ def transcribe_with_groq(audio_path):
         return
 
     try:
-        # ★ 初始化 Groq Client
+        # ★ 初始化 Groq Client (SDK 只在真的要轉錄時才載入)
+        import groq
         client = groq.Groq(api_key=groq_key)
 
         print(f"\n⚡️ 正在將檔案 '{os.path.basename(audio_path)}' 上傳至 Groq... (準備感受速度！)")
@@ -70,6 +70,7 @@ def transcribe_with_groq(audio_path):
         with open(txt_path, 'w', encoding='utf-8') as f:
             f.write(transcription.text)
         print(f"\n💾 純文字逐字稿已儲存至：{txt_path}")
+        return True
 
     except Exception as e:
         print(f"\n❌ 呼叫 Groq API 時發生錯誤: {e}")
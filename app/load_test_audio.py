@@ -0,0 +1,84 @@
+import time
+import random
+import asyncio
+import argparse
+import statistics
+
+import httpx
+
+# 對 /episodes/{id}/audio 做本機壓力測試：模擬大量聽眾同時以 Range 請求邊聽邊拖曳進度條。
+# 使用方式：先啟動 uvicorn app.main:app，再執行 python app/load_test_audio.py --clients 200
+
+
+async def _discover_episode(client):
+    """沒有指定集數時，自動挑第一個節目的第一集。"""
+    podcasts = (await client.get("/podcasts")).json()
+    for podcast in podcasts:
+        episodes = (await client.get(f"/podcasts/{podcast}/episodes")).json()
+        if episodes:
+            return episodes[0]["id"], episodes[0]["size"]
+    raise SystemExit("❌ 錯誤：找不到任何可以測試的集數。")
+
+
+async def _listener(client, path, file_size, range_size, deadline, stats):
+    """一位聽眾：從隨機位置開始，一段一段往後讀，偶爾跳到別的位置。"""
+    offset = random.randrange(0, max(file_size - range_size, 1))
+    while time.monotonic() < deadline:
+        if random.random() < 0.1:
+            offset = random.randrange(0, max(file_size - range_size, 1))
+        end = min(offset + range_size, file_size) - 1
+        start_time = time.monotonic()
+        try:
+            response = await client.get(path, headers={"Range": f"bytes={offset}-{end}"})
+        except httpx.HTTPError:
+            stats["errors"] += 1
+            continue
+        stats["latencies"].append(time.monotonic() - start_time)
+        if response.status_code != 206:
+            stats["errors"] += 1
+            continue
+        stats["bytes"] += len(response.content)
+        stats["requests"] += 1
+        offset = end + 1 if end + 1 < file_size else 0
+
+
+async def run_load_test(base_url, episode_id, clients, duration, range_size, ad_free):
+    limits = httpx.Limits(max_connections=clients, max_keepalive_connections=clients)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=30) as client:
+        if episode_id:
+            head = await client.head(f"/episodes/{episode_id}/audio")
+            file_size = int(head.headers["Content-Length"])
+        else:
+            episode_id, file_size = await _discover_episode(client)
+        path = f"/episodes/{episode_id}/audio" + ("/ad-free" if ad_free else "")
+        if ad_free:
+            file_size = int((await client.head(path)).headers["Content-Length"])
+
+        print(f"🚀 {clients} 位聽眾，持續 {duration} 秒，每次讀取 {range_size // 1024} KB：{path}")
+        stats = {"bytes": 0, "requests": 0, "errors": 0, "latencies": []}
+        deadline = time.monotonic() + duration
+        start_time = time.monotonic()
+        await asyncio.gather(*[
+            _listener(client, path, file_size, range_size, deadline, stats) for _ in range(clients)
+        ])
+        elapsed = time.monotonic() - start_time
+
+    latencies = sorted(stats["latencies"]) or [0]
+    print("\n--- 壓力測試結果 ---")
+    print(f"請求數: {stats['requests']} ({stats['requests'] / elapsed:.0f} req/s)，錯誤: {stats['errors']}")
+    print(f"吞吐量: {stats['bytes'] / elapsed / 1024 / 1024:.1f} MB/s")
+    print(f"延遲: p50 {statistics.median(latencies) * 1000:.1f} ms，"
+          f"p95 {latencies[int(len(latencies) * 0.95) - 1] * 1000:.1f} ms")
+    return stats
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="音檔串流端點的本機壓力測試")
+    parser.add_argument("--url", default="http://127.0.0.1:8000")
+    parser.add_argument("--episode", help="集數 ID (預設自動挑選)")
+    parser.add_argument("--clients", type=int, default=100)
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--range-kb", type=int, default=256)
+    parser.add_argument("--ad-free", action="store_true", help="測試 .ad_free.mp3 端點")
+    args = parser.parse_args()
+    asyncio.run(run_load_test(args.url, args.episode, args.clients, args.duration, args.range_kb * 1024, args.ad_free))
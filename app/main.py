@@ -1,10 +1,23 @@
 # app/main.py
 import os
-from fastapi import FastAPI, HTTPException
+import sys
+import time
+import base64
+import binascii
+from email.utils import formatdate, parsedate_to_datetime
+from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import Response
 from pathlib import Path
 from typing import List
 
+import anyio
+
+# 以 `uvicorn app.main:app` 啟動時，讓同一層的模組 (例如 storage_manager) 也能被匯入
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from run_whisper_cpp import is_transcript_complete
+
 # --- 初始化 FastAPI 應用 ---
 app = FastAPI(
     title="Podcast AI Processor API",
@@ -20,6 +33,8 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    # 讓前端的 <audio> / fetch 讀得到 Range 相關的回應標頭
+    expose_headers=["Accept-Ranges", "Content-Range", "Content-Length", "ETag", "Last-Modified"],
 )
 
 # --- 資料夾路徑設定 ---
@@ -50,14 +65,241 @@ def list_podcasts():
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"讀取節目列表時發生錯誤: {e}")
 
-# ... 未來我們會在這裡加入更多強大的 API 端點 ...
-# 例如：
-# @app.post("/process/transcribe")
-# def transcribe_episode(file_path: str):
-#     # 這裡會呼叫 whisper.cpp 的邏輯
-#     pass
-#
-# @app.post("/process/analyze")
-# def analyze_transcript(transcript_path: str):
-#     # 這裡會呼叫 Gemini API 的邏輯
-#     pass
+
+# --- 音檔串流 ---
+
+# 每次從磁碟讀多少送出；讀檔是在執行緒池中一塊一塊進行，不會讓每個聽眾都佔住一條執行緒
+STREAM_CHUNK_SIZE = 256 * 1024
+# 若前面有 nginx，設定這個前綴 (例如 "/protected-audio/") 就改由 nginx 以 sendfile 傳送檔案
+X_ACCEL_PREFIX = os.getenv("AUDIO_X_ACCEL_PREFIX")
+# 同一集播放時每隔多久才更新一次空間管理的「最近使用」紀錄
+TOUCH_INTERVAL = 10 * 60
+_last_touched = {}
+
+
+def encode_episode_id(relative_path: str) -> str:
+    """把集數相對於 BASE_DIR 的路徑編成網址安全的 ID。"""
+    return base64.urlsafe_b64encode(relative_path.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def resolve_episode_path(episode_id: str) -> Path:
+    """
+    把 ID 解回原始 mp3 的路徑，並確認它真的在 BASE_DIR 之內。
+    原始檔可能已被空間管理 (keep_only_ad_free) 刪除，只剩 .ad_free.mp3，這裡不要求它存在。
+    """
+    try:
+        padded = episode_id + "=" * (-len(episode_id) % 4)
+        relative_path = base64.urlsafe_b64decode(padded.encode("ascii")).decode("utf-8")
+    except (binascii.Error, UnicodeError, ValueError):
+        raise HTTPException(status_code=404, detail="找不到這一集。")
+    path = (BASE_DIR / relative_path).resolve()
+    if BASE_DIR.resolve() not in path.parents or not relative_path.endswith(".mp3"):
+        raise HTTPException(status_code=404, detail="找不到這一集。")
+    return path
+
+
+def _parse_range(range_header: str, file_size: int):
+    """
+    解析單一的 "bytes=start-end" 區段，回傳 (start, end) (含 end)。
+    無法滿足回傳 "unsatisfiable"；格式不支援 (例如多段) 回傳 None，改送整個檔案。
+    """
+    if not range_header.startswith("bytes=") or "," in range_header:
+        return None
+    start_str, _, end_str = range_header[len("bytes="):].strip().partition("-")
+    try:
+        if not start_str:
+            # "bytes=-500" 代表最後 500 bytes
+            length = int(end_str)
+            if length <= 0:
+                return "unsatisfiable"
+            return max(file_size - length, 0), file_size - 1
+        start = int(start_str)
+        end = int(end_str) if end_str else file_size - 1
+    except ValueError:
+        return None
+    if start >= file_size or end < start:
+        return "unsatisfiable"
+    return start, min(end, file_size - 1)
+
+
+class AudioFileResponse(Response):
+    """
+    支援 Range、ETag / Last-Modified 重新驗證的音檔回應。
+    伺服器支援 ASGI 的 zerocopysend 擴充時直接用 sendfile 傳送；
+    設定了 AUDIO_X_ACCEL_PREFIX 時交給 nginx；其他情況則非同步分塊讀取。
+    """
+
+    media_type = "audio/mpeg"
+
+    def __init__(self, path: Path, request: Request, send_body: bool = True):
+        super().__init__(status_code=200, media_type=self.media_type)
+        self.path = path
+        self.send_body = send_body
+        self.range = None
+
+        stat = os.stat(path)
+        self.file_size = stat.st_size
+        etag = f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+        last_modified = formatdate(stat.st_mtime, usegmt=True)
+        self.headers["Accept-Ranges"] = "bytes"
+        self.headers["ETag"] = etag
+        self.headers["Last-Modified"] = last_modified
+        self.headers["Cache-Control"] = "no-cache"
+
+        if self._not_modified(request, etag, stat.st_mtime):
+            self.status_code = 304
+            self.send_body = False
+            del self.headers["content-length"]
+            return
+
+        range_header = request.headers.get("range")
+        if_range = request.headers.get("if-range")
+        # If-Range 與目前的檔案不符時 (檔案已變更)，忽略 Range 改送整個檔案
+        if range_header and (not if_range or if_range in (etag, last_modified)):
+            parsed = _parse_range(range_header, self.file_size)
+            if parsed == "unsatisfiable":
+                self.status_code = 416
+                self.send_body = False
+                self.headers["Content-Range"] = f"bytes */{self.file_size}"
+                self.headers["Content-Length"] = "0"
+                return
+            if parsed is not None:
+                self.range = parsed
+                self.status_code = 206
+                self.headers["Content-Range"] = f"bytes {parsed[0]}-{parsed[1]}/{self.file_size}"
+
+        start, end = self.range or (0, self.file_size - 1)
+        self.headers["Content-Length"] = str(max(end - start + 1, 0))
+
+    @staticmethod
+    def _not_modified(request: Request, etag: str, mtime: float) -> bool:
+        if_none_match = request.headers.get("if-none-match")
+        if if_none_match is not None:
+            return etag in [tag.strip() for tag in if_none_match.split(",")] or if_none_match.strip() == "*"
+        if_modified_since = request.headers.get("if-modified-since")
+        if if_modified_since:
+            try:
+                return int(mtime) <= parsedate_to_datetime(if_modified_since).timestamp()
+            except (TypeError, ValueError):
+                return False
+        return False
+
+    async def __call__(self, scope, receive, send):
+        start, end = self.range or (0, self.file_size - 1)
+        count = end - start + 1
+
+        if self.send_body and X_ACCEL_PREFIX:
+            # nginx 會自己處理 Range 與 sendfile，這裡只要告訴它檔案在哪
+            relative_path = self.path.relative_to(BASE_DIR.resolve()).as_posix()
+            self.status_code = 200
+            self.headers["X-Accel-Redirect"] = X_ACCEL_PREFIX.rstrip("/") + "/" + relative_path
+            for header in ("content-length", "content-range"):
+                if header in self.headers:
+                    del self.headers[header]
+            await send({"type": "http.response.start", "status": 200, "headers": self.raw_headers})
+            await send({"type": "http.response.body", "body": b""})
+            return
+
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+        if not self.send_body or count <= 0:
+            await send({"type": "http.response.body", "body": b""})
+            return
+
+        # zerocopysend 擴充規定 "file" 要是有 fileno() 的檔案物件，不能直接給 fd 整數
+        with open(self.path, "rb", buffering=0) as audio_file:
+            if "http.response.zerocopysend" in scope.get("extensions", {}):
+                await send({"type": "http.response.zerocopysend", "file": audio_file, "offset": start, "count": count})
+                return
+            fd = audio_file.fileno()
+            offset = start
+            remaining = count
+            while remaining > 0:
+                chunk = await anyio.to_thread.run_sync(os.pread, fd, min(STREAM_CHUNK_SIZE, remaining), offset)
+                if not chunk:
+                    break
+                offset += len(chunk)
+                remaining -= len(chunk)
+                await send({"type": "http.response.body", "body": chunk, "more_body": remaining > 0})
+            if remaining > 0:
+                # 檔案在傳送途中被截短，結束這個回應
+                await send({"type": "http.response.body", "body": b""})
+
+
+async def _touch_for_storage(path: Path):
+    """告訴空間管理這一集剛被播放過 (節流，避免每個 Range 請求都寫一次帳本)。"""
+    now = time.time()
+    if now - _last_touched.get(path, 0) < TOUCH_INTERVAL:
+        return
+    _last_touched[path] = now
+    from storage_manager import touch_episode
+    try:
+        await anyio.to_thread.run_sync(touch_episode, str(path), str(BASE_DIR.resolve()))
+    except OSError:
+        pass
+
+
+async def _serve_audio(episode_id: str, request: Request, ad_free: bool):
+    original = resolve_episode_path(episode_id)
+    ad_free_path = original.with_name(original.stem + ".ad_free.mp3")
+    # 原始檔已被刪除、只保留去廣告版本時，原始音檔的網址也改播去廣告版本
+    path = ad_free_path if ad_free or not original.exists() else original
+    if not path.is_file():
+        raise HTTPException(status_code=404, detail="找不到這個音檔。")
+    response = AudioFileResponse(path, request, send_body=request.method != "HEAD")
+    if response.status_code in (200, 206):
+        await _touch_for_storage(original)
+    return response
+
+
+@app.get("/podcasts/{podcast}/episodes")
+def list_episodes(podcast: str):
+    """
+    列出某個節目的所有集數，附上播放用的 ID 以及是否已有逐字稿、分析結果與去廣告版本。
+    原始檔已被刪除、只剩去廣告版本的集數 has_original 為 False，播放時會直接送去廣告版本。
+    """
+    podcast_dir = (BASE_DIR / podcast).resolve()
+    if BASE_DIR.resolve() not in podcast_dir.parents or not podcast_dir.is_dir():
+        raise HTTPException(status_code=404, detail="找不到這個節目。")
+
+    file_names = {entry.name for entry in os.scandir(podcast_dir) if entry.is_file()}
+    episodes = []
+    for name in file_names:
+        if name.endswith(".ad_free.mp3"):
+            # 原始檔已被空間管理刪除、只剩去廣告版本的集數也要列出來
+            stem = name[:-len(".ad_free.mp3")]
+            if stem + ".mp3" in file_names:
+                continue
+            name = stem + ".mp3"
+        elif (not name.endswith(".mp3") or name.startswith("compressed_")
+                or name.endswith(".compressed.mp3")):
+            continue
+        stem = name[:-len(".mp3")]
+        has_original = name in file_names
+        audio_name = name if has_original else stem + ".ad_free.mp3"
+        episodes.append({
+            "id": encode_episode_id(f"{podcast_dir.name}/{name}"),
+            "title": stem,
+            "size": (podcast_dir / audio_name).stat().st_size,
+            "has_original": has_original,
+            "has_transcript": is_transcript_complete(str(podcast_dir / (name + ".json"))),
+            "has_analysis": (podcast_dir / (name + ".analysis.json")).exists(),
+            "has_ad_free": stem + ".ad_free.mp3" in file_names,
+        })
+    episodes.sort(key=lambda episode: episode["title"], reverse=True)
+    return episodes
+
+
+@app.api_route("/episodes/{episode_id}/audio", methods=["GET", "HEAD"])
+async def episode_audio(episode_id: str, request: Request):
+    """
+    播放原始音檔。支援 Range (拖曳進度條)、ETag / Last-Modified 重新驗證。
+    """
+    return await _serve_audio(episode_id, request, ad_free=False)
+
+
+@app.api_route("/episodes/{episode_id}/audio/ad-free", methods=["GET", "HEAD"])
+async def episode_audio_ad_free(episode_id: str, request: Request):
+    """
+    播放剪掉廣告後的 .ad_free.mp3 版本。
+    """
+    return await _serve_audio(episode_id, request, ad_free=True)
@@ -8,11 +8,18 @@ def sanitize_filename(filename):
     """清除檔案名稱中的無效字元，使其可以在檔案系統中安全使用。"""
     return re.sub(r'[\\/*?:"<>|]', "", filename)
 
-def download_episode(url, save_path):
-    """下載單一音檔並顯示進度，如果檔案已存在則跳過。"""
+def download_episode(url, save_path, guid=None):
+    """
+    下載單一音檔並顯示進度，如果檔案已存在則跳過。
+    下載前會先查去重索引，同一集 (同 guid、網址或內容) 已經有了就直接連結過去。
+    """
     if os.path.exists(save_path):
         print(f"✅ 已存在，跳過。")
         return True
+
+    from dedup_index import resolve_before_download, register_download
+    if resolve_before_download(url, save_path, guid=guid):
+        return True
         
     try:
         print(f"  📥 下載中...")
@@ -24,6 +31,7 @@ def download_episode(url, save_path):
                 f.write(chunk)
         
         print(f"  👍 下載成功！")
+        register_download(url, save_path, guid=guid)
         return True
 
     except requests.exceptions.RequestException as e:
@@ -32,32 +40,52 @@ def download_episode(url, save_path):
             os.remove(save_path)
         return False
 
-def parse_and_download_podcast():
-    """主程式：提示使用者輸入 RSS Feed URL 和下載數量，並下載對應的集數。"""
-    rss_url = input("請貼上 Podcast 的 RSS Feed URL：\n> ")
+def parse_episode(item):
+    """
+    從 RSS 的 <item> 取出一集節目的資訊。
+    找不到音檔連結時 audio_url 為 None。
+    """
+    ep_title = item.findtext('title', 'Untitled Episode')
 
-    if not rss_url.startswith(('http://', 'https://')):
-        print("錯誤：這不是一個有效的 URL。")
-        return
-
-    # ★ 新增功能：詢問要下載的集數
-    num_to_download_str = input("你想下載最新的幾集？ (請輸入數字，或直接按 Enter 下載全部)\n> ")
-    num_to_download = None
-    if num_to_download_str.strip():
+    pub_date_str = item.findtext('pubDate', '')
+    pub_date = None
+    date_prefix = 'NODATE'
+    if pub_date_str:
         try:
-            num = int(num_to_download_str)
-            if num > 0:
-                num_to_download = num
+            pub_date = datetime.strptime(pub_date_str.strip(), '%a, %d %b %Y %H:%M:%S %z')
+            date_prefix = pub_date.strftime('%Y-%m-%d')
         except ValueError:
-            print("輸入無效，將下載全部集數。")
-            
+            pass
+
+    enclosure = item.find('enclosure')
+    audio_url = None
+    if enclosure is not None and 'url' in enclosure.attrib:
+        audio_url = enclosure.attrib['url']
+
+    guid = (item.findtext('guid') or '').strip() or None
+
+    safe_ep_title = sanitize_filename(ep_title)
+    return {
+        'title': ep_title,
+        'guid': guid,
+        'pub_date': pub_date,
+        'audio_url': audio_url,
+        'filename': f"{date_prefix} - {safe_ep_title}.mp3",
+    }
+
+def download_podcast(rss_url, num_to_download=None, stream_mode=False, model_size=None):
+    """
+    下載 RSS Feed 最新的 num_to_download 集 (None 表示全部)。
+    stream_mode 為 True 時會邊下載邊用 whisper.cpp 轉錄。
+    回傳成功取得的音檔路徑列表；Feed 無法取得或解析時回傳 None。
+    """
     try:
         print("\n📡 正在取得並解析 RSS Feed...")
         response = requests.get(rss_url, timeout=15)
         response.raise_for_status()
     except requests.exceptions.RequestException as e:
         print(f"錯誤：無法取得 RSS Feed。\n{e}")
-        return
+        return None
 
     try:
         root = ET.fromstring(response.content)
@@ -87,38 +115,63 @@ def parse_and_download_podcast():
         total_to_process = len(items_to_process)
         print(f"開始檢查與下載...\n")
 
+        saved_paths = []
         for i, item in enumerate(items_to_process):
-            ep_title = item.findtext('title', 'Untitled Episode')
-            print(f"--- ({i+1}/{total_to_process}) 正在處理：{ep_title} ---")
-            
-            pub_date_str = item.findtext('pubDate', '')
-            date_prefix = 'NODATE'
-            if pub_date_str:
-                try:
-                    date_obj = datetime.strptime(pub_date_str, '%a, %d %b %Y %H:%M:%S %z')
-                    date_prefix = date_obj.strftime('%Y-%m-%d')
-                except ValueError:
-                     pass
-
-            enclosure = item.find('enclosure')
-            if enclosure is None or 'url' not in enclosure.attrib:
+            episode = parse_episode(item)
+            print(f"--- ({i+1}/{total_to_process}) 正在處理：{episode['title']} ---")
+
+            if episode['audio_url'] is None:
                 print(f"  ⚠️ 警告：找不到音檔連結，已跳過。")
                 continue
+
+            audio_url = episode['audio_url']
+            filepath = os.path.join(podcast_dir, episode['filename'])
             
-            audio_url = enclosure.attrib['url']
-            
-            safe_ep_title = sanitize_filename(ep_title)
-            filename = f"{date_prefix} - {safe_ep_title}.mp3"
-            filepath = os.path.join(podcast_dir, filename)
-            
-            download_episode(url=audio_url, save_path=filepath)
+            if stream_mode:
+                from stream_transcribe import stream_download_and_transcribe
+                ok = stream_download_and_transcribe(url=audio_url, save_path=filepath, model_size=model_size,
+                                                    guid=episode['guid'])
+            else:
+                ok = download_episode(url=audio_url, save_path=filepath, guid=episode['guid'])
+            if ok:
+                saved_paths.append(filepath)
 
         print("\n🎉 所有任務完成！")
+        return saved_paths
 
     except ET.ParseError:
         print("錯誤：無法解析 RSS Feed。")
     except Exception as e:
         print(f"發生未預期的錯誤：{e}")
+    return None
+
+def parse_and_download_podcast():
+    """主程式：提示使用者輸入 RSS Feed URL 和下載數量，並下載對應的集數。"""
+    rss_url = input("請貼上 Podcast 的 RSS Feed URL：\n> ")
+
+    if not rss_url.startswith(('http://', 'https://')):
+        print("錯誤：這不是一個有效的 URL。")
+        return
+
+    # ★ 新增功能：詢問要下載的集數
+    num_to_download_str = input("你想下載最新的幾集？ (請輸入數字，或直接按 Enter 下載全部)\n> ")
+    num_to_download = None
+    if num_to_download_str.strip():
+        try:
+            num = int(num_to_download_str)
+            if num > 0:
+                num_to_download = num
+        except ValueError:
+            print("輸入無效，將下載全部集數。")
+
+    # ★ 新增功能：邊下載邊轉錄，下載完不久就能拿到逐字稿
+    stream_mode = input("要邊下載邊用 whisper.cpp 轉錄嗎？ (y/N)\n> ").strip().lower() == "y"
+    model_size = None
+    if stream_mode:
+        from run_whisper_cpp import select_model_size
+        model_size = select_model_size()
+
+    download_podcast(rss_url, num_to_download=num_to_download, stream_mode=stream_mode, model_size=model_size)
 
 # --- 主程式執行區 ---
 if __name__ == "__main__":
@@ -2,6 +2,20 @@ import os
 import subprocess
 import time
 
+# 串流轉錄會邊轉邊改寫逐字稿，轉錄期間旁邊放一個 <逐字稿>.inprogress 標記，成功後才移除。
+# 程式中途被砍掉時標記會留下來，讓其他地方知道這份逐字稿不完整、需要重做。
+INPROGRESS_SUFFIX = ".inprogress"
+
+
+def transcript_marker_path(json_path):
+    return json_path + INPROGRESS_SUFFIX
+
+
+def is_transcript_complete(json_path):
+    """逐字稿存在、而且沒有「轉錄中」的標記時才算完成。"""
+    return os.path.exists(json_path) and not os.path.exists(transcript_marker_path(json_path))
+
+
 def select_mp3_file():
     """
     提供互動式選單，讓使用者選擇要轉錄的 .mp3 檔案。
@@ -31,8 +45,8 @@ def select_mp3_file():
         print("❌ 選擇無效。")
         return None
         
-    # 只列出還沒有 .json 逐字稿的 mp3 檔案
-    mp3_files = [f for f in os.listdir(podcast_path) if f.endswith(".mp3") and not os.path.exists(os.path.join(podcast_path, f + ".json"))]
+    # 只列出還沒有完整 .json 逐字稿的 mp3 檔案
+    mp3_files = [f for f in os.listdir(podcast_path) if f.endswith(".mp3") and not is_transcript_complete(os.path.join(podcast_path, f + ".json"))]
     if not mp3_files:
         print(f"✅ 在 '{podcasts[choice - 1]}' 中沒有找到需要轉錄的新檔案。")
         return None
@@ -61,19 +75,26 @@ def select_model_size():
         print("選擇無效，將使用預設的 'base' 模型。")
         return "base"
 
-def transcribe_with_whisper_cpp(audio_path, model_size):
+def get_whisper_paths(model_size):
+    """回傳 whisper-cli 執行檔與指定模型檔案的路徑。"""
+    home_dir = os.path.expanduser("~")
+    whisper_cpp_dir = os.path.join(home_dir, "whisper.cpp")
+
+    # 根據我們之前的結論，使用新的 whisper-cli 執行檔
+    executable_path = os.path.join(whisper_cpp_dir, "build", "bin", "whisper-cli")
+    model_path = os.path.join(whisper_cpp_dir, "models", f"ggml-{model_size}.bin")
+    return executable_path, model_path
+
+def transcribe_with_whisper_cpp(audio_path, model_size, threads=None, processors=None):
     """
     使用 Python 的 subprocess 模組來呼叫 whisper.cpp 的執行檔。
+    threads / processors 對應 whisper-cli 的 -t / -p，不給則使用 whisper.cpp 的預設值。
+    成功時回傳 True。
     """
     if not audio_path or not model_size:
         return
 
-    home_dir = os.path.expanduser("~")
-    whisper_cpp_dir = os.path.join(home_dir, "whisper.cpp")
-    
-    # 根據我們之前的結論，使用新的 whisper-cli 執行檔
-    executable_path = os.path.join(whisper_cpp_dir, "build", "bin", "whisper-cli")
-    model_path = os.path.join(whisper_cpp_dir, "models", f"ggml-{model_size}.bin")
+    executable_path, model_path = get_whisper_paths(model_size)
 
     if not os.path.exists(executable_path):
         print(f"❌ 錯誤：找不到 whisper.cpp 執行檔於 '{executable_path}'")
@@ -87,6 +108,8 @@ def transcribe_with_whisper_cpp(audio_path, model_size):
     print("\n" + "="*50)
     print(f"準備執行 whisper.cpp 轉錄...")
     print(f"  - 模型: {model_size}")
+    if threads or processors:
+        print(f"  - 設定: -t {threads or '預設'} -p {processors or '預設'}")
     print(f"  - 檔案: {os.path.basename(audio_path)}")
     print("="*50 + "\n")
     
@@ -100,6 +123,10 @@ def transcribe_with_whisper_cpp(audio_path, model_size):
         "-l", "auto", # 自動偵測語言
         "-oj" # ★ 關鍵：這個參數會讓它產生 .json 輸出！
     ]
+    if threads:
+        command += ["-t", str(threads)]
+    if processors:
+        command += ["-p", str(processors)]
 
     try:
         start_time = time.time()
@@ -114,6 +141,7 @@ def transcribe_with_whisper_cpp(audio_path, model_size):
         print(f"總耗時: {end_time - start_time:.2f} 秒")
         print(f"💾 附時間戳記的 JSON 檔案已儲存至: {output_json_path}")
         print("*"*50)
+        return True
 
     except FileNotFoundError:
         # 這個錯誤通常發生在 subprocess 找不到 command[0] 的執行檔時
@@ -124,10 +152,37 @@ def transcribe_with_whisper_cpp(audio_path, model_size):
     except Exception as e:
         print(f"❌ 發生未知錯誤: {e}")
 
+def auto_transcribe_with_whisper_cpp(audio_path, deadline_sec=None, target_rtf=None):
+    """
+    依 whisper_tuning.py 的校準結果，自動挑選能在期限內完成的最準模型與 -t / -p 設定。
+    還沒校準過時回傳 None，由呼叫端決定要不要改用手動選擇；轉錄失敗回傳 False。
+    """
+    from whisper_tuning import choose_whisper_settings, get_audio_duration
+
+    duration_sec = get_audio_duration(audio_path)
+    settings = choose_whisper_settings(duration_sec, deadline_sec=deadline_sec, target_rtf=target_rtf)
+    if settings is None:
+        return None
+
+    print(f"\n🤖 自動選擇：{settings['model']} (-t {settings['threads']} -p {settings['processors']}，"
+          f"RTF {settings['rtf']:.3f}，容許 {settings['allowed_rtf']:.3f})")
+    if "estimated_sec" in settings:
+        print(f"   預估耗時約 {settings['estimated_sec']:.0f} 秒")
+    return bool(transcribe_with_whisper_cpp(audio_path, settings["model"], settings["threads"], settings["processors"]))
+
 if __name__ == "__main__":
     mp3_file_to_process = select_mp3_file()
     
     if mp3_file_to_process:
-        chosen_model_size = select_model_size()
-        if chosen_model_size:
-            transcribe_with_whisper_cpp(mp3_file_to_process, chosen_model_size)
\ No newline at end of file
+        deadline_str = input("> 希望在幾分鐘內完成？ (直接按 Enter 則要求跟得上即時播放速度): ").strip()
+        deadline_sec = None
+        try:
+            deadline_sec = float(deadline_str) * 60 if deadline_str else None
+        except ValueError:
+            print("輸入無效，將不設定期限。")
+
+        if auto_transcribe_with_whisper_cpp(mp3_file_to_process, deadline_sec=deadline_sec) is None:
+            print("\nℹ️ 尚未校準過這台主機 (可執行 python app/whisper_tuning.py)，改為手動選擇模型。")
+            chosen_model_size = select_model_size()
+            if chosen_model_size:
+                transcribe_with_whisper_cpp(mp3_file_to_process, chosen_model_size)
\ No newline at end of file
@@ -0,0 +1,325 @@
+import os
+import json
+import socket
+import threading
+import time
+from contextlib import contextmanager
+
+from file_lock import locked_file
+
+# 空間管理：依照設定的容量上限與各階段的保留規則清理 podcast_downloads。
+# 用量記在 .storage_usage.json 裡，只重新掃描「資料夾修改時間有變」的節目資料夾，
+# 不必每次檢查都走訪整棵目錄樹。
+BASE_DIR = "podcast_downloads"
+CONFIG_FILE = os.path.join(BASE_DIR, ".storage.json")
+USAGE_FILE = os.path.join(BASE_DIR, ".storage_usage.json")
+
+# 去廣告版本的長度與「原始長度扣掉廣告」相差在這個秒數內，才算是完整匯出
+RENDER_DURATION_TOLERANCE = 2.0
+
+# 檔案在資料夾裡變大 (例如下載中) 不會改變資料夾的修改時間，所以每隔一段時間仍會整個重掃一次
+FULL_RESCAN_INTERVAL = 60 * 60
+
+DEFAULT_CONFIG = {
+    "budget_gb": None,
+    "retention": {
+        # 轉錄完成後刪除為了上傳 API 而產生的壓縮檔 (compressed_*.mp3、*.compressed.mp3)
+        "delete_intermediates_after_transcription": True,
+        # 有了完整且比分析結果新的 .ad_free.mp3 之後只保留去廣告版本，刪除原始檔
+        "keep_only_ad_free": False,
+        # 超出容量而淘汰某一集時，保留逐字稿與分析結果等文字檔
+        "evict_keep_text": True,
+    },
+}
+
+# 由長到短比對，才不會把 ".mp3.json" 誤判成 ".json"
+_SUFFIXES = [
+    (".mp3.analysis.json", "analysis"),
+    (".analysis.json", "analysis"),
+    (".ads.json", "analysis"),
+    (".mp3.json", "transcript"),
+    (".ad_free.mp3", "ad_free"),
+    (".compressed.mp3", "intermediate"),
+    (".mp3", "original"),
+    (".txt", "transcript"),
+    (".json", "transcript"),
+]
+AUDIO_STAGES = ("original", "intermediate", "ad_free")
+
+
+def classify(file_name):
+    """回傳 (集數名稱, 階段)；不認得的檔案回傳 (None, None)。"""
+    if file_name.startswith("compressed_") and file_name.endswith(".mp3"):
+        return file_name[len("compressed_"):-len(".mp3")], "intermediate"
+    for suffix, stage in _SUFFIXES:
+        if file_name.endswith(suffix):
+            return file_name[:-len(suffix)], stage
+    return None, None
+
+
+def load_config(path=CONFIG_FILE):
+    config = json.loads(json.dumps(DEFAULT_CONFIG))
+    if os.path.exists(path):
+        with open(path, 'r', encoding='utf-8') as f:
+            user_config = json.load(f)
+        config["retention"].update(user_config.pop("retention", {}))
+        config.update(user_config)
+    return config
+
+
+def _budget_bytes(config):
+    if config.get("budget_bytes"):
+        return int(config["budget_bytes"])
+    if config.get("budget_gb"):
+        return int(float(config["budget_gb"]) * 1024 ** 3)
+    return None
+
+
+class StorageManager:
+    """維護用量帳本，並依設定刪除中間檔或淘汰最久沒用到的集數。"""
+
+    def __init__(self, base_dir=BASE_DIR, usage_path=None):
+        self.base_dir = base_dir
+        self.usage_path = usage_path or os.path.join(base_dir, os.path.basename(USAGE_FILE))
+        self.usage = {"dirs": {}, "access": {}, "full_scan": 0}
+
+    # --- 帳本 ---
+
+    def _load(self):
+        if os.path.exists(self.usage_path):
+            try:
+                with open(self.usage_path, 'r', encoding='utf-8') as f:
+                    self.usage = json.load(f)
+            except (OSError, json.JSONDecodeError):
+                print(f"⚠️ 警告：無法讀取用量帳本 '{self.usage_path}'，將重新掃描。")
+        self.usage.setdefault("dirs", {})
+        self.usage.setdefault("access", {})
+        self.usage.setdefault("full_scan", 0)
+
+    def _save(self):
+        tmp_path = f"{self.usage_path}.{socket.gethostname()}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.usage, f, ensure_ascii=False)
+        os.replace(tmp_path, self.usage_path)
+
+    @contextmanager
+    def locked(self, save=True):
+        os.makedirs(self.base_dir, exist_ok=True)
+        with locked_file(self.usage_path + ".lock"):
+            self._load()
+            yield self
+            if save:
+                self._save()
+
+    def _scan_dir(self, rel_dir, dir_mtime):
+        files = {}
+        with os.scandir(os.path.join(self.base_dir, rel_dir)) as entries:
+            for entry in entries:
+                if entry.name.startswith(".") or entry.name.endswith(".tmp"):
+                    continue
+                try:
+                    st = entry.stat(follow_symlinks=False)
+                except FileNotFoundError:
+                    continue
+                if entry.is_dir(follow_symlinks=False):
+                    continue
+                files[entry.name] = {"size": st.st_size, "mtime": st.st_mtime, "link": entry.is_symlink()}
+        self.usage["dirs"][rel_dir] = {"mtime": dir_mtime, "files": files}
+
+    def refresh(self, full=False):
+        """
+        更新用量帳本：只 stat 最上層的節目資料夾，修改時間沒變的資料夾直接沿用上次的紀錄。
+        """
+        now = time.time()
+        full = full or now - self.usage["full_scan"] > FULL_RESCAN_INTERVAL
+        seen = set()
+        if os.path.isdir(self.base_dir):
+            with os.scandir(self.base_dir) as entries:
+                for entry in entries:
+                    if entry.name.startswith(".") or not entry.is_dir(follow_symlinks=False):
+                        continue
+                    seen.add(entry.name)
+                    dir_mtime = entry.stat().st_mtime
+                    cached = self.usage["dirs"].get(entry.name)
+                    if full or cached is None or cached["mtime"] != dir_mtime:
+                        self._scan_dir(entry.name, dir_mtime)
+        for rel_dir in set(self.usage["dirs"]) - seen:
+            del self.usage["dirs"][rel_dir]
+        if full:
+            self.usage["full_scan"] = now
+
+    def total_bytes(self):
+        return sum(f["size"] for d in self.usage["dirs"].values() for f in d["files"].values())
+
+    def touch(self, episode_path):
+        """記錄某一集剛被使用 (播放、處理)，供 LRU 淘汰參考。"""
+        rel_dir = os.path.relpath(os.path.dirname(episode_path), self.base_dir)
+        name, _ = classify(os.path.basename(episode_path))
+        if name is not None:
+            self.usage["access"][f"{rel_dir}/{name}"] = time.time()
+
+    def episodes(self):
+        """把帳本裡的檔案依集數分組：{"節目/集數": {"files": {檔名: 階段}, "bytes": ..., "last_used": ...}}"""
+        grouped = {}
+        for rel_dir, info in self.usage["dirs"].items():
+            for file_name, meta in info["files"].items():
+                name, stage = classify(file_name)
+                if name is None:
+                    continue
+                key = f"{rel_dir}/{name}"
+                ep = grouped.setdefault(key, {"dir": rel_dir, "files": {}, "bytes": 0, "last_used": 0, "links": 0})
+                ep["files"][file_name] = stage
+                ep["bytes"] += meta["size"]
+                ep["last_used"] = max(ep["last_used"], meta["mtime"])
+                if meta.get("link"):
+                    ep["links"] += 1
+        for key, ep in grouped.items():
+            ep["last_used"] = max(ep["last_used"], self.usage["access"].get(key, 0))
+        return grouped
+
+    # --- 清理 ---
+
+    def _delete(self, rel_dir, file_name, dry_run):
+        path = os.path.join(self.base_dir, rel_dir, file_name)
+        size = self.usage["dirs"][rel_dir]["files"].get(file_name, {}).get("size", 0)
+        # 試跑時只從帳本移除 (帳本不會寫回)，讓後續的容量計算與實際執行時一致
+        if not dry_run:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+        self.usage["dirs"][rel_dir]["files"].pop(file_name, None)
+        return size
+
+    def _mark_removed(self, rel_dir, original_name, removed):
+        """在去重索引中註記這一集已被移除，避免訂閱程式又把它下載回來。"""
+        from dedup_index import DedupIndex
+        index = DedupIndex(path=os.path.join(self.base_dir, ".dedup_index.json"), base_dir=self.base_dir)
+        with index.locked():
+            rel_path = os.path.join(rel_dir, original_name)
+            if rel_path in index.episodes:
+                index.episodes[rel_path]["removed"] = removed
+
+    def _render_replaces_original(self, ep):
+        """
+        去廣告版本可以取代原始檔的條件：比分析結果新 (增量重新分析後還沒重剪的不算)，
+        而且長度等於原始檔扣掉廣告時段 (當掉的匯出留下的半個檔案不算)。無法確認時一律保留原始檔。
+        """
+        by_stage = {}
+        for file_name, stage in ep["files"].items():
+            by_stage.setdefault(stage, []).append(file_name)
+        if len(by_stage.get("original", [])) != 1 or len(by_stage.get("ad_free", [])) != 1:
+            return False
+        original, ad_free = by_stage["original"][0], by_stage["ad_free"][0]
+        analysis = original + ".analysis.json"
+        folder = os.path.join(self.base_dir, ep["dir"])
+        # 分析結果是原地改寫的，不會改變資料夾的修改時間，帳本裡的 mtime 可能是舊的，這裡直接 stat
+        try:
+            if os.path.getmtime(os.path.join(folder, ad_free)) <= os.path.getmtime(os.path.join(folder, analysis)):
+                return False
+        except OSError:
+            return False
+
+        from cut_ads import load_ad_intervals
+        from whisper_tuning import get_audio_duration
+        original_sec = get_audio_duration(os.path.join(folder, original))
+        ad_free_sec = get_audio_duration(os.path.join(folder, ad_free))
+        if original_sec is None or ad_free_sec is None:
+            return False
+        try:
+            intervals = load_ad_intervals(os.path.join(folder, analysis))
+        except (OSError, ValueError):
+            return False
+        removed_sec = sum(min(end, original_sec) - start for start, end in intervals if start < original_sec)
+        return abs(original_sec - removed_sec - ad_free_sec) <= RENDER_DURATION_TOLERANCE
+
+    def apply_retention(self, config, dry_run=False):
+        """套用各階段的保留規則，回傳釋放的位元組數。"""
+        rules = config["retention"]
+        freed = 0
+        for key, ep in self.episodes().items():
+            stages = set(ep["files"].values())
+            replaced = None
+            for file_name, stage in ep["files"].items():
+                delete = False
+                if stage == "intermediate" and rules.get("delete_intermediates_after_transcription"):
+                    delete = "transcript" in stages
+                if rules.get("keep_only_ad_free") and "ad_free" in stages and stage in ("original", "intermediate"):
+                    if replaced is None:
+                        replaced = self._render_replaces_original(ep)
+                    delete = delete or replaced
+                if delete:
+                    print(f"🧹 {'(試跑) ' if dry_run else ''}刪除 {ep['dir']}/{file_name}")
+                    freed += self._delete(ep["dir"], file_name, dry_run)
+                    if stage == "original" and not dry_run:
+                        self._mark_removed(ep["dir"], file_name, "original")
+        return freed
+
+    def evict_lru(self, budget, config, dry_run=False):
+        """用量超過 budget 時，從最久沒用到的集數開始刪除音檔，直到低於上限。回傳釋放的位元組數。"""
+        total = self.total_bytes()
+        if total <= budget:
+            return 0
+        keep_text = config["retention"].get("evict_keep_text", True)
+        freed = 0
+        for key, ep in sorted(self.episodes().items(), key=lambda item: item[1]["last_used"]):
+            if total - freed <= budget:
+                break
+            # 只剩符號連結 (去重後的重複集數) 或已經沒有音檔的集數，淘汰也釋放不了空間
+            if ep["links"] == len(ep["files"]):
+                continue
+            if keep_text and not set(ep["files"].values()) & set(AUDIO_STAGES):
+                continue
+            print(f"🗑️ {'(試跑) ' if dry_run else ''}淘汰 {key} ({ep['bytes'] / 1024 / 1024:.1f} MB)")
+            for file_name, stage in ep["files"].items():
+                if keep_text and stage not in AUDIO_STAGES:
+                    continue
+                freed += self._delete(ep["dir"], file_name, dry_run)
+                if stage == "original" and not dry_run:
+                    self._mark_removed(ep["dir"], file_name, "episode")
+        return freed
+
+    def _remove_dangling_links(self):
+        """正本被刪掉之後，指向它的重複集數連結也一併清掉。"""
+        for rel_dir, info in self.usage["dirs"].items():
+            for file_name, meta in list(info["files"].items()):
+                path = os.path.join(self.base_dir, rel_dir, file_name)
+                if meta.get("link") and not os.path.exists(path):
+                    self._delete(rel_dir, file_name, dry_run=False)
+
+    def enforce(self, config, dry_run=False):
+        self.refresh()
+        before = self.total_bytes()
+        freed = self.apply_retention(config, dry_run=dry_run)
+        budget = _budget_bytes(config)
+        if budget is not None:
+            freed += self.evict_lru(budget, config, dry_run=dry_run)
+        if not dry_run:
+            self._remove_dangling_links()
+        return before, freed, budget
+
+
+def enforce_storage_budget(config_path=CONFIG_FILE, dry_run=False, quiet=False):
+    """讀取設定並執行一次清理；沒有設定檔時什麼都不做。回傳清理後的用量 (位元組)。"""
+    if not os.path.exists(config_path) and quiet:
+        return None
+    config = load_config(config_path)
+    manager = StorageManager()
+    with manager.locked(save=not dry_run):
+        before, freed, budget = manager.enforce(config, dry_run=dry_run)
+    if not quiet or freed:
+        budget_str = f"{budget / 1024 ** 3:.2f} GB" if budget is not None else "未設定"
+        print(f"💽 用量 {before / 1024 ** 3:.2f} GB，上限 {budget_str}，"
+              f"{'可' if dry_run else '已'}釋放 {freed / 1024 ** 2:.1f} MB")
+    return before - freed
+
+
+def touch_episode(episode_path, base_dir=BASE_DIR):
+    """記錄某一集剛被使用；供 API 串流播放等地方呼叫。"""
+    manager = StorageManager(base_dir=base_dir)
+    with manager.locked():
+        manager.touch(episode_path)
+
+
+if __name__ == "__main__":
+    enforce_storage_budget()
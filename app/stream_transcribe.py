@@ -0,0 +1,350 @@
+import os
+import json
+import queue
+import subprocess
+import tempfile
+import threading
+import time
+import wave
+
+import requests
+
+from run_whisper_cpp import get_whisper_paths, transcript_marker_path, is_transcript_complete
+
+# whisper.cpp 只吃 16kHz、單聲道、16-bit 的 PCM
+SAMPLE_RATE = 16000
+SAMPLE_WIDTH = 2
+DEFAULT_WINDOW_SEC = 30
+FILE_MODE_PENDING_WINDOWS = 2  # 轉錄本機檔案時最多預先解碼幾個視窗
+
+
+def make_whisper_window_transcriber(model_size, extra_args=None):
+    """
+    建立一個「轉錄單一音訊視窗」的函式，內部呼叫 whisper-cli。
+    回傳的函式接收 .wav 路徑，回傳相對於該視窗開頭的 segment 列表。
+    """
+    executable_path, model_path = get_whisper_paths(model_size)
+    if not os.path.exists(executable_path):
+        raise FileNotFoundError(f"找不到 whisper.cpp 執行檔於 '{executable_path}'")
+    if not os.path.exists(model_path):
+        raise FileNotFoundError(f"找不到模型檔案 '{model_path}'")
+
+    def transcribe_window(wav_path):
+        output_prefix = os.path.splitext(wav_path)[0]
+        command = [
+            executable_path,
+            "-m", model_path,
+            "-f", wav_path,
+            "-l", "auto",
+            "-oj",
+            "-of", output_prefix,  # 輸出成 <output_prefix>.json
+            "-np",  # 不要在終端機印出轉錄過程
+        ] + list(extra_args or [])
+        subprocess.run(command, check=True, stdout=subprocess.DEVNULL)
+
+        with open(output_prefix + ".json", 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        os.remove(output_prefix + ".json")
+
+        # whisper-cli 的 offsets 單位是毫秒
+        return [
+            {
+                "start": item["offsets"]["from"] / 1000.0,
+                "end": item["offsets"]["to"] / 1000.0,
+                "text": item["text"].strip(),
+            } for item in data.get("transcription", [])
+        ]
+
+    return transcribe_window
+
+
+def _start_decoder():
+    """啟動 ffmpeg，從 stdin 讀入 mp3 位元流，並從 stdout 輸出原始 PCM。"""
+    command = [
+        "ffmpeg",
+        "-loglevel", "error",
+        "-i", "pipe:0",
+        "-f", "s16le",
+        "-ac", "1",
+        "-ar", str(SAMPLE_RATE),
+        "pipe:1",
+    ]
+    return subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+
+
+def _put_window(windows, item, stop_event):
+    """放進佇列；佇列有上限時會在這裡等轉錄端消化，轉錄端已經停止則放棄並回傳 False。"""
+    while not stop_event.is_set():
+        try:
+            windows.put(item, timeout=0.5)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def _put_end_marker(windows, stop_event):
+    """
+    放入結束訊號 None。資料視窗可以放棄，結束訊號不行，否則轉錄端會永遠等在 get() 上；
+    已經停止時先清掉佇列裡用不到的視窗，確保放得進去。
+    """
+    while True:
+        if stop_event.is_set():
+            try:
+                while True:
+                    windows.get_nowait()
+            except queue.Empty:
+                pass
+        try:
+            windows.put(None, timeout=0.5)
+            return
+        except queue.Full:
+            continue
+
+
+def _read_windows(pcm_stream, window_bytes, windows, stop_event):
+    """把解碼後的 PCM 切成固定長度的視窗，依序放進佇列；結束時放入 None。"""
+    index = 0
+    buffer = bytearray()
+    while True:
+        chunk = pcm_stream.read(65536)
+        if not chunk:
+            break
+        if stop_event.is_set():
+            # 轉錄端已經停了，仍要把解碼器的輸出讀完，ffmpeg 才不會卡住而讓餵資料的一端也跟著卡住
+            continue
+        buffer.extend(chunk)
+        while len(buffer) >= window_bytes:
+            _put_window(windows, (index, bytes(buffer[:window_bytes])), stop_event)
+            del buffer[:window_bytes]
+            index += 1
+    # 最後一段不滿一個視窗長度的音訊也要轉錄
+    if buffer:
+        _put_window(windows, (index, bytes(buffer)), stop_event)
+    _put_end_marker(windows, stop_event)
+
+
+def _write_segments(json_path, segments):
+    """以「先寫暫存檔再改名」的方式更新逐字稿，讓讀取端永遠看到完整的 JSON。"""
+    tmp_path = json_path + ".tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(segments, f, ensure_ascii=False, indent=4)
+    os.replace(tmp_path, json_path)
+
+
+def _transcribe_windows(windows, transcribe_window, json_path, window_sec, stop_event, state):
+    """從佇列取出視窗逐一轉錄，並把新的 segment 即時附加到逐字稿 JSON。"""
+    segments = []
+    _write_segments(json_path, segments)
+    with tempfile.TemporaryDirectory(prefix="stream_whisper_") as tmp_dir:
+        while True:
+            try:
+                item = windows.get(timeout=0.5)
+            except queue.Empty:
+                # 下載或讀檔失敗時由主執行緒設定 stop_event，不必等結束訊號
+                if stop_event.is_set():
+                    break
+                continue
+            if item is None or stop_event.is_set():
+                break
+            index, pcm = item
+
+            wav_path = os.path.join(tmp_dir, f"window_{index:05d}.wav")
+            with wave.open(wav_path, 'wb') as wav_file:
+                wav_file.setnchannels(1)
+                wav_file.setsampwidth(SAMPLE_WIDTH)
+                wav_file.setframerate(SAMPLE_RATE)
+                wav_file.writeframes(pcm)
+
+            try:
+                window_segments = transcribe_window(wav_path)
+            except Exception as e:
+                state["error"] = e
+                stop_event.set()
+                break
+            finally:
+                os.remove(wav_path)
+
+            # 把視窗內的相對時間換算成整集的絕對時間
+            offset = index * window_sec
+            for seg in window_segments:
+                segments.append({
+                    "start": seg["start"] + offset,
+                    "end": seg["end"] + offset,
+                    "text": seg["text"],
+                })
+            _write_segments(json_path, segments)
+            state["windows_done"] = index + 1
+            print(f"  📝 已完成第 {index + 1} 個視窗 (至 {offset + len(pcm) / SAMPLE_RATE / SAMPLE_WIDTH:.0f} 秒)")
+
+
+def _run_pipeline(chunks, save_path, json_path, transcribe_window, window_sec, max_pending_windows=0):
+    """
+    共用的串流流程：把 chunks 依序送進 ffmpeg 解碼器 (save_path 不為 None 時同時寫入檔案)，
+    解碼後的音訊每滿 window_sec 秒就交給 transcribe_window。
+    max_pending_windows 限制還沒轉錄的視窗最多能排幾個 (0 為不限)；超過時解碼會暫停等待轉錄。
+    成功回傳完成的視窗數，失敗回傳 None 並清掉不完整的檔案。
+    """
+    window_bytes = int(window_sec * SAMPLE_RATE) * SAMPLE_WIDTH
+    windows = queue.Queue(maxsize=max_pending_windows)
+    stop_event = threading.Event()
+    state = {"error": None, "windows_done": 0}
+
+    # 先放好「轉錄中」標記，之後就算整個行程被砍掉，也不會把半份逐字稿當成完成
+    marker_path = transcript_marker_path(json_path)
+    open(marker_path, 'w').close()
+
+    try:
+        decoder = _start_decoder()
+    except FileNotFoundError:
+        print("  ❌ 錯誤：找不到 ffmpeg，無法進行串流解碼。")
+        os.remove(marker_path)
+        return None
+
+    # 解碼讀取與轉錄各自一條執行緒，轉錄慢的時候不會卡住下載 (邊下載邊轉錄時佇列不設上限)
+    reader = threading.Thread(target=_read_windows, args=(decoder.stdout, window_bytes, windows, stop_event),
+                              daemon=True)
+    worker = threading.Thread(
+        target=_transcribe_windows,
+        args=(windows, transcribe_window, json_path, window_sec, stop_event, state),
+        daemon=True,
+    )
+    reader.start()
+    worker.start()
+
+    feed_ok = False
+    out_file = open(save_path, 'wb') if save_path else None
+    try:
+        for chunk in chunks:
+            if stop_event.is_set():
+                break
+            if out_file:
+                out_file.write(chunk)
+            try:
+                decoder.stdin.write(chunk)
+            except BrokenPipeError:
+                # 解碼器提早結束，檔案仍繼續下載完
+                pass
+        feed_ok = not stop_event.is_set()
+    except (requests.exceptions.RequestException, OSError) as e:
+        print(f"\n  ❌ 讀取音訊串流失敗：{e}")
+        stop_event.set()
+    finally:
+        if out_file:
+            out_file.close()
+        try:
+            decoder.stdin.close()
+        except BrokenPipeError:
+            pass
+
+    reader.join()
+    worker.join()
+    decoder.wait()
+
+    if not feed_ok or state["error"] is not None:
+        if state["error"] is not None:
+            print(f"  ❌ 轉錄過程中發生錯誤：{state['error']}")
+        for path in (save_path, json_path, marker_path):
+            if path and os.path.exists(path):
+                os.remove(path)
+        return None
+    os.remove(marker_path)
+    return state["windows_done"]
+
+
+def _resolve_transcriber(transcribe_window, model_size):
+    if transcribe_window is not None:
+        return transcribe_window
+    extra_args = None
+    if model_size == "auto":
+        # 串流時每個視窗都要在下一個視窗到來前轉完，所以至少要跟得上即時速度
+        from whisper_tuning import choose_whisper_settings
+        settings = choose_whisper_settings()
+        if settings is None:
+            # 與整檔轉錄相同：沒校準過就退回 base 模型
+            print("  ℹ️ 尚未校準過這台主機，改用 base 模型。")
+            model_size = "base"
+        else:
+            model_size = settings["model"]
+            extra_args = ["-t", str(settings["threads"]), "-p", str(settings["processors"])]
+            print(f"  🤖 自動選擇：{model_size} (-t {settings['threads']} -p {settings['processors']})")
+    try:
+        return make_whisper_window_transcriber(model_size, extra_args)
+    except FileNotFoundError as e:
+        print(f"  ❌ 錯誤：{e}")
+        return None
+
+
+def stream_download_and_transcribe(url, save_path, model_size="base", window_sec=DEFAULT_WINDOW_SEC,
+                                   transcribe_window=None, chunk_size=8192, guid=None):
+    """
+    邊下載邊轉錄：下載串流同時寫入檔案與 ffmpeg 解碼器，
+    解碼後的音訊每滿 window_sec 秒就送進轉錄後端，
+    逐字稿 (save_path + ".json") 會隨著每個視窗完成而逐步更新。
+
+    transcribe_window 可自行傳入 (接收 .wav 路徑、回傳 segment 列表)，
+    預設使用本機的 whisper.cpp。
+    """
+    json_path = save_path + ".json"
+    if os.path.exists(save_path) and is_transcript_complete(json_path):
+        print(f"✅ 已存在，跳過。")
+        return True
+
+    from dedup_index import resolve_before_download, register_download
+    if not os.path.exists(save_path) and resolve_before_download(url, save_path, guid=guid):
+        return True
+
+    transcribe_window = _resolve_transcriber(transcribe_window, model_size)
+    if transcribe_window is None:
+        return False
+
+    start_time = time.time()
+    try:
+        print(f"  📥 下載並同步轉錄中...")
+        response = requests.get(url, stream=True, timeout=30)
+        response.raise_for_status()
+    except requests.exceptions.RequestException as e:
+        print(f"\n  ❌ 下載失敗：{e}")
+        return False
+
+    windows_done = _run_pipeline(response.iter_content(chunk_size=chunk_size), save_path, json_path,
+                                 transcribe_window, window_sec)
+    if windows_done is None:
+        return False
+    register_download(url, save_path, guid=guid)
+
+    print(f"  🎉 逐字稿已就緒 (共 {windows_done} 個視窗，總耗時 {time.time() - start_time:.2f} 秒)")
+    print(f"  💾 已儲存至：{json_path}")
+    return True
+
+
+def _iter_file(path, chunk_size):
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            yield chunk
+
+
+def stream_transcribe_file(audio_path, model_size="base", window_sec=DEFAULT_WINDOW_SEC,
+                           transcribe_window=None, chunk_size=65536):
+    """
+    以同樣的視窗流程轉錄已下載好的音檔，輸出 audio_path + ".json"
+    (與邊下載邊轉錄的格式相同，可直接交給 google_API 分析)。
+    """
+    json_path = audio_path + ".json"
+    transcribe_window = _resolve_transcriber(transcribe_window, model_size)
+    if transcribe_window is None:
+        return False
+
+    start_time = time.time()
+    # 本機檔案讀取遠比轉錄快，限制排隊的視窗數，免得整集的 PCM (每小時約 115MB) 都先解碼進記憶體
+    windows_done = _run_pipeline(_iter_file(audio_path, chunk_size), None, json_path,
+                                 transcribe_window, window_sec, max_pending_windows=FILE_MODE_PENDING_WINDOWS)
+    if windows_done is None:
+        return False
+
+    print(f"  🎉 轉錄完成 (共 {windows_done} 個視窗，總耗時 {time.time() - start_time:.2f} 秒)")
+    print(f"  💾 已儲存至：{json_path}")
+    return True
@@ -0,0 +1,351 @@
+import os
+import json
+import heapq
+import functools
+import random
+import statistics
+import threading
+import time
+import xml.etree.ElementTree as ET
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from podcast_downloader import sanitize_filename, parse_episode, download_episode
+
+BASE_DIR = "podcast_downloads"
+DEFAULT_SUBSCRIPTIONS_FILE = "subscriptions.json"
+STATE_FILE = os.path.join(BASE_DIR, ".subscriptions_state.json")
+
+# --- 排程參數 (秒) ---
+MIN_INTERVAL = 5 * 60          # 預計快要出新集時，最密集的輪詢間隔
+DEFAULT_INTERVAL = 60 * 60     # 還沒有足夠發佈紀錄時的間隔
+MAX_INTERVAL = 12 * 60 * 60    # 閒置節目最久多久才檢查一次
+JITTER = 0.1                   # ±10% 隨機抖動，避免所有節目同時打出去
+PUB_HISTORY_SIZE = 20          # 用最近幾集的發佈時間推估週期
+MAX_EPISODE_ATTEMPTS = 5       # 同一集處理失敗幾次後就放棄，不再重試
+
+
+def load_subscriptions(path):
+    """
+    讀取訂閱清單。格式可以是單純的 URL 陣列，或是：
+    {"max_concurrent_polls": 4, "feeds": [{"url": "...", "name": "..."}]}
+    """
+    with open(path, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    if isinstance(data, list):
+        data = {"feeds": data}
+    feeds = []
+    for feed in data.get("feeds", []):
+        if isinstance(feed, str):
+            feed = {"url": feed}
+        if feed.get("url", "").startswith(('http://', 'https://')):
+            feeds.append(feed)
+        else:
+            print(f"⚠️ 警告：訂閱清單中有無效的 URL，已略過：{feed}")
+    data["feeds"] = feeds
+    return data
+
+
+def load_state(path=STATE_FILE):
+    if not os.path.exists(path):
+        return {}
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, json.JSONDecodeError):
+        print(f"⚠️ 警告：無法讀取排程狀態檔 '{path}'，將重新建立。")
+        return {}
+
+
+def save_state(state, path=STATE_FILE):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(state, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+
+
+def compute_next_interval(feed_state, now=None):
+    """
+    根據節目過去的發佈週期決定下次輪詢要等多久：
+    - 距離預估的下一集還很久 → 睡到接近預估時間再說 (最多 MAX_INTERVAL)
+    - 進入預估時間附近 → 以 MIN_INTERVAL 密集檢查
+    - 已經超過預估時間很久 (可能停更) → 間隔逐漸拉長
+    連續失敗時則以指數退避。最後加上隨機抖動。
+    """
+    now = now or time.time()
+    failures = feed_state.get("failures", 0)
+    pub_times = sorted(feed_state.get("pub_times", []))
+
+    if failures:
+        interval = min(MAX_INTERVAL, MIN_INTERVAL * (2 ** failures))
+    elif len(pub_times) < 2:
+        interval = DEFAULT_INTERVAL
+    else:
+        gaps = [b - a for a, b in zip(pub_times, pub_times[1:]) if b > a]
+        cadence = statistics.median(gaps) if gaps else DEFAULT_INTERVAL
+        expected_next = pub_times[-1] + cadence
+        # 在預估時間前後這段區間內密集檢查
+        window = min(max(MIN_INTERVAL, cadence * 0.1), 2 * 60 * 60)
+        if now < expected_next - window:
+            interval = expected_next - window - now
+        else:
+            overdue = max(0, now - expected_next)
+            interval = MIN_INTERVAL + overdue * 0.25
+
+    interval = min(max(interval, MIN_INTERVAL), MAX_INTERVAL)
+    return interval * random.uniform(1 - JITTER, 1 + JITTER)
+
+
+def episode_key(episode):
+    return episode['guid'] or episode['audio_url']
+
+
+def poll_feed(feed, feed_state, initial_episodes=1):
+    """
+    檢查一個 RSS Feed，回傳 (podcast_dir, 新集數列表)。
+    使用 ETag / Last-Modified 做條件式請求，沒有更新時伺服器只會回 304。
+    第一次訂閱時只會挑最新的 initial_episodes 集，其餘舊集只標記為已看過。
+    新集數要等處理成功後才會記入 seen，處理失敗的下次輪詢會再出現一次。
+    """
+    headers = {}
+    # 有集數等待重試時要抓完整的 Feed，否則伺服器回 304 就看不到那幾集了
+    if not feed_state.get("failed"):
+        if feed_state.get("etag"):
+            headers["If-None-Match"] = feed_state["etag"]
+        if feed_state.get("last_modified"):
+            headers["If-Modified-Since"] = feed_state["last_modified"]
+
+    response = requests.get(feed["url"], headers=headers, timeout=15)
+    if response.status_code == 304:
+        return None, []
+    response.raise_for_status()
+
+    feed_state["etag"] = response.headers.get("ETag")
+    feed_state["last_modified"] = response.headers.get("Last-Modified")
+
+    root = ET.fromstring(response.content)
+    podcast_title = feed.get("name") or root.findtext('./channel/title', 'Untitled Podcast')
+    podcast_dir = os.path.join(BASE_DIR, sanitize_filename(podcast_title))
+
+    episodes = [parse_episode(item) for item in root.findall('./channel/item')]
+    episodes = [ep for ep in episodes if ep['audio_url']]
+
+    pub_times = [ep['pub_date'].timestamp() for ep in episodes if ep['pub_date']]
+    feed_state["pub_times"] = sorted(pub_times)[-PUB_HISTORY_SIZE:]
+
+    first_poll = "seen" not in feed_state
+    seen = set(feed_state.get("seen", []))
+    new_episodes = [ep for ep in episodes if episode_key(ep) not in seen]
+    if first_poll:
+        # RSS Feed 通常最新的在最前面；沒挑中的舊集數直接當作已看過
+        new_episodes = new_episodes[:initial_episodes]
+        picked = {episode_key(ep) for ep in new_episodes}
+        seen = {episode_key(ep) for ep in episodes} - picked
+
+    # 只保留還在 Feed 裡的集數，避免紀錄無限增長
+    feed_state["seen"] = [episode_key(ep) for ep in episodes if episode_key(ep) in seen]
+    return podcast_dir, new_episodes
+
+
+def process_episode(podcast_dir, episode, config):
+    """新集數直接進入處理流程：下載 (可選擇邊下載邊轉錄)，再交給 Gemini 分析廣告。成功時回傳 True。"""
+    os.makedirs(podcast_dir, exist_ok=True)
+    filepath = os.path.join(podcast_dir, episode['filename'])
+    print(f"\n🆕 新集數：{episode['title']}")
+
+    model_size = config.get("whisper_model")
+    if model_size:
+        from stream_transcribe import stream_download_and_transcribe
+        ok = stream_download_and_transcribe(url=episode['audio_url'], save_path=filepath, model_size=model_size,
+                                            guid=episode['guid'])
+    else:
+        ok = download_episode(url=episode['audio_url'], save_path=filepath, guid=episode['guid'])
+
+    transcript_path = filepath + ".json"
+    if ok and config.get("analyze") and os.path.exists(transcript_path):
+        from google_API import analyze_transcript_with_google_api
+        ok = bool(analyze_transcript_with_google_api(transcript_path))
+    if ok:
+        from dedup_index import relink_duplicates
+        relink_duplicates(filepath)
+
+    # 每處理完一集就檢查一次容量 (有 .storage.json 設定檔時才會動作)
+    from storage_manager import enforce_storage_budget
+    enforce_storage_budget(quiet=True)
+    return ok
+
+
+def _log_future_error(future):
+    """背景工作的例外會被 executor 吞掉，至少要印出來。"""
+    if not future.cancelled() and future.exception() is not None:
+        print(f"❌ 背景工作發生未預期的錯誤：{future.exception()}")
+
+
+def run_daemon(subscriptions_path=DEFAULT_SUBSCRIPTIONS_FILE):
+    """
+    依照訂閱清單持續輪詢所有節目。
+    每個節目各自排程，同時進行的輪詢數量受 max_concurrent_polls 限制；
+    發現的新集數交給另一個 (預設單執行緒的) 處理佇列，避免同時轉錄多集拖垮機器。
+    """
+    config = load_subscriptions(subscriptions_path)
+    subscriptions_mtime = os.path.getmtime(subscriptions_path)
+    state = load_state()
+    state_lock = threading.Lock()
+
+    poll_pool = ThreadPoolExecutor(max_workers=config.get("max_concurrent_polls", 4))
+    process_pool = ThreadPoolExecutor(max_workers=config.get("max_concurrent_processing", 1))
+
+    schedule = []
+    # 每個節目目前有效的下次輪詢時間；時間表裡跟它對不上的項目是過期的，取出時直接丟掉，
+    # 節目被移除又加回訂閱清單時才不會留下兩筆項目、從此照兩套時間輪詢
+    pending = {}
+    in_flight = set()
+    processing = set()  # (url, 集數 key)：已經排入處理佇列、還沒有結果的集數
+    wakeup = threading.Event()
+
+    def schedule_feed(url, when):
+        with state_lock:
+            pending[url] = when
+            heapq.heappush(schedule, (when, url))
+        wakeup.set()
+
+    feeds = {feed["url"]: feed for feed in config["feeds"]}
+    now = time.time()
+    for url in feeds:
+        # 上次關閉前排好的時間照舊；新訂閱則在啟動後隨機錯開
+        next_poll = state.get(url, {}).get("next_poll") or now + random.uniform(0, 30)
+        pending[url] = max(next_poll, now)
+        heapq.heappush(schedule, (pending[url], url))
+
+    def episode_done(url, episode, future):
+        """處理完一集後記錄結果：成功才記入 seen，失敗則留待下次輪詢重試，超過次數就放棄。"""
+        key = episode_key(episode)
+        try:
+            ok = future.result()
+        except Exception as e:
+            print(f"❌ 處理 '{episode['title']}' 時發生未預期的錯誤：{e}")
+            ok = False
+
+        with state_lock:
+            processing.discard((url, key))
+            # seen / failed 一律整個換掉而不是原地修改，進行中的輪詢手上的快照才不會跟著變
+            feed_state = state.setdefault(url, {})
+            failed = dict(feed_state.get("failed", {}))
+            if not ok:
+                failed[key] = failed.get(key, 0) + 1
+                if failed[key] < MAX_EPISODE_ATTEMPTS:
+                    print(f"🔁 '{episode['title']}' 處理失敗 ({failed[key]}/{MAX_EPISODE_ATTEMPTS})，下次輪詢會再試。")
+                else:
+                    print(f"⚠️ 警告：'{episode['title']}' 已失敗 {failed[key]} 次，不再重試。")
+                    ok = True
+            if ok:
+                failed.pop(key, None)
+                feed_state["seen"] = feed_state.get("seen", []) + [key]
+            feed_state["failed"] = failed
+            try:
+                save_state(state)
+            except OSError as e:
+                print(f"⚠️ 警告：無法儲存排程狀態：{e}")
+
+    def poll_job(url):
+        feed = feeds.get(url)
+        if feed is None:
+            # 已經從訂閱清單中移除
+            with state_lock:
+                in_flight.discard(url)
+            return
+
+        with state_lock:
+            feed_state = dict(state.get(url, {}))
+        snapshot_seen = set(feed_state.get("seen", []))
+        # 不論中間發生什麼錯誤，都要把這個節目排回時間表，否則它會從此不再被輪詢
+        try:
+            try:
+                podcast_dir, new_episodes = poll_feed(feed, feed_state, config.get("initial_episodes", 1))
+                feed_state["failures"] = 0
+            except (requests.exceptions.RequestException, ET.ParseError) as e:
+                print(f"❌ 檢查 '{feed.get('name', url)}' 失敗：{e}")
+                podcast_dir, new_episodes = None, []
+                feed_state["failures"] = feed_state.get("failures", 0) + 1
+
+            for episode in new_episodes:
+                key = (url, episode_key(episode))
+                with state_lock:
+                    if key in processing:
+                        continue
+                    processing.add(key)
+                future = process_pool.submit(process_episode, podcast_dir, episode, config)
+                future.add_done_callback(functools.partial(episode_done, url, episode))
+        except Exception as e:
+            print(f"❌ 輪詢 '{feed.get('name', url)}' 時發生未預期的錯誤：{e}")
+            feed_state["failures"] = feed_state.get("failures", 0) + 1
+        finally:
+            now = time.time()
+            feed_state["last_poll"] = now
+            feed_state["next_poll"] = now + compute_next_interval(feed_state, now)
+            with state_lock:
+                # 輪詢期間剛處理完的集數已經直接寫進 state，合併回來才不會被這次輪詢的結果蓋掉
+                live = state.get(url, {})
+                added = [k for k in live.get("seen", []) if k not in snapshot_seen]
+                feed_state["seen"] = feed_state.get("seen", []) + [k for k in added if k not in feed_state.get("seen", [])]
+                feed_state["failed"] = live.get("failed", {})
+                state[url] = feed_state
+                in_flight.discard(url)
+                try:
+                    save_state(state)
+                except OSError as e:
+                    print(f"⚠️ 警告：無法儲存排程狀態：{e}")
+            schedule_feed(url, feed_state["next_poll"])
+
+    print(f"🛰️ 訂閱常駐模式啟動，共 {len(feeds)} 個節目。按 Ctrl+C 結束。")
+    try:
+        while True:
+            # 訂閱清單有變動就重新載入，新節目會立刻排入
+            try:
+                mtime = os.path.getmtime(subscriptions_path)
+                if mtime != subscriptions_mtime:
+                    subscriptions_mtime = mtime
+                    config = load_subscriptions(subscriptions_path)
+                    new_feeds = {feed["url"]: feed for feed in config["feeds"]}
+                    for url in new_feeds.keys() - feeds.keys():
+                        schedule_feed(url, time.time())
+                    feeds = new_feeds
+                    print(f"🔄 已重新載入訂閱清單，共 {len(feeds)} 個節目。")
+            except (OSError, json.JSONDecodeError) as e:
+                print(f"⚠️ 警告：重新載入訂閱清單失敗：{e}")
+
+            now = time.time()
+            with state_lock:
+                due = []
+                while schedule and schedule[0][0] <= now:
+                    when, url = heapq.heappop(schedule)
+                    if pending.get(url) != when:
+                        continue
+                    del pending[url]
+                    if url in feeds and url not in in_flight:
+                        in_flight.add(url)
+                        due.append(url)
+                next_due = schedule[0][0] if schedule else now + MIN_INTERVAL
+                wakeup.clear()
+
+            for url in due:
+                poll_pool.submit(poll_job, url).add_done_callback(_log_future_error)
+
+            wakeup.wait(timeout=min(max(next_due - time.time(), 1), 60))
+    except KeyboardInterrupt:
+        print("\n👋 收到中斷訊號，等待進行中的工作結束...")
+    finally:
+        poll_pool.shutdown(wait=True)
+        process_pool.shutdown(wait=True)
+        with state_lock:
+            save_state(state)
+
+
+if __name__ == "__main__":
+    path = input(f"請輸入訂閱清單檔案路徑 [預設為 {DEFAULT_SUBSCRIPTIONS_FILE}]：\n> ").strip() or DEFAULT_SUBSCRIPTIONS_FILE
+    if not os.path.exists(path):
+        print(f"❌ 錯誤：找不到訂閱清單 '{path}'。")
+    else:
+        run_daemon(path)
@@ -1,6 +1,5 @@
 import os
 import json
-import openai
 from dotenv import load_dotenv
 
 # ... select_json_file() 函式保持不變 ...
@@ -45,6 +44,8 @@ def analyze_transcript_with_gemma(json_transcript_path):
         print("❌ 錯誤：請在 .env 檔案中設定 OPENROUTER_API_KEY")
         return
 
+    # 只有真的要呼叫 OpenRouter 時才載入 openai SDK
+    import openai
     client = openai.OpenAI(
         base_url="https://openrouter.ai/api/v1",
         api_key=openrouter_key,
@@ -1,8 +1,6 @@
 import os
 import json # ★ 新增：匯入 json 函式庫
-from openai import OpenAI
 from dotenv import load_dotenv
-from pydub import AudioSegment
 
 # 如果你的環境變數還是有問題，可以保留這一行
 # AudioSegment.ffmpeg = "C:/ffmpeg/bin/ffmpeg.exe"
@@ -15,6 +13,7 @@ def compress_audio_if_needed(file_path, target_size_mb=24.5):
         return file_path
     print(f"⚠️ 檔案大小 ({file_size / 1024 / 1024:.2f}MB) 超過 {target_size_mb}MB 限制，開始進行智慧壓縮...")
     try:
+        from pydub import AudioSegment
         audio = AudioSegment.from_mp3(file_path)
         duration_in_seconds = len(audio) / 1000.0
         if duration_in_seconds == 0: return None
@@ -45,6 +44,7 @@ def transcribe_audio_with_api(audio_file_path):
         return
 
     try:
+        from openai import OpenAI
         load_dotenv()
         client = OpenAI()
         print(f"\n🎧 正在上傳並轉錄檔案：'{file_to_upload}'...")
@@ -0,0 +1,216 @@
+import os
+import re
+import glob
+import json
+import socket
+import subprocess
+import tempfile
+import time
+
+from run_whisper_cpp import get_whisper_paths
+
+# 校準結果依主機名稱分開存放，多台機器共用家目錄時也不會互相覆蓋
+CALIBRATION_FILE = os.path.join(os.path.expanduser("~"), "whisper.cpp", "calibration.json")
+DEFAULT_CLIP_SEC = 60
+# 沒有指定期限時，至少要跟得上即時播放的速度
+DEFAULT_TARGET_RTF = 1.0
+
+# 由小到大，越後面越準
+MODEL_FAMILIES = ["tiny", "base", "small", "medium", "large"]
+
+
+def is_english_only(model_name):
+    """*.en 模型只會英文，會無視 -l auto，拿來轉錄中文節目只會產生英文亂碼。"""
+    return model_name.split("-")[0].endswith(".en")
+
+
+def _english_only_allowed():
+    return os.getenv("WHISPER_ALLOW_EN_MODELS", "").lower() in ("1", "true", "yes")
+
+
+def list_available_models(include_english_only=None):
+    """
+    列出 ~/whisper.cpp/models 底下所有的 ggml-*.bin 模型名稱，例如 base、large-v3-q5_0。
+    預設不含 *.en 英文專用模型；傳入 include_english_only=True 或設定環境變數 WHISPER_ALLOW_EN_MODELS=1 才會列出。
+    """
+    if include_english_only is None:
+        include_english_only = _english_only_allowed()
+    _, base_model_path = get_whisper_paths("base")
+    models_dir = os.path.dirname(base_model_path)
+    names = []
+    for path in glob.glob(os.path.join(models_dir, "ggml-*.bin")):
+        name = os.path.basename(path)[len("ggml-"):-len(".bin")]
+        # 跳過 whisper.cpp 測試用的小模型與 VAD 模型
+        if name.startswith("for-tests") or "silero" in name:
+            continue
+        if is_english_only(name) and not include_english_only:
+            continue
+        names.append(name)
+    return sorted(names, key=model_accuracy_rank)
+
+
+def model_accuracy_rank(model_name):
+    """
+    估計模型的相對準確度 (數字越大越準)：先看模型大小，再看版本，量化過的略遜於原始模型。
+    """
+    family = model_name.split(".")[0].split("-")[0]
+    family_rank = MODEL_FAMILIES.index(family) if family in MODEL_FAMILIES else -1
+    version = re.search(r"-v(\d+)", model_name)
+    version_rank = int(version.group(1)) if version else 0
+    quantized = re.search(r"-q\d", model_name) is not None
+    return (family_rank, version_rank, not quantized)
+
+
+def get_audio_duration(audio_path):
+    """用 ffprobe 取得音檔長度 (秒)，失敗時回傳 None。"""
+    command = [
+        "ffprobe", "-v", "error",
+        "-show_entries", "format=duration",
+        "-of", "default=noprint_wrappers=1:nokey=1",
+        audio_path,
+    ]
+    try:
+        result = subprocess.run(command, check=True, capture_output=True, text=True)
+        return float(result.stdout.strip())
+    except (FileNotFoundError, subprocess.CalledProcessError, ValueError):
+        return None
+
+
+def _default_thread_options():
+    cpu_count = os.cpu_count() or 1
+    return sorted({t for t in (1, 2, 4, 8, cpu_count) if t <= cpu_count})
+
+
+def load_calibration():
+    """讀取這台主機的校準結果，沒有的話回傳 None。"""
+    if not os.path.exists(CALIBRATION_FILE):
+        return None
+    try:
+        with open(CALIBRATION_FILE, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return None
+    return data.get(socket.gethostname())
+
+
+def calibrate(sample_audio, models=None, thread_options=None, processor_options=(1, 2), clip_sec=DEFAULT_CLIP_SEC):
+    """
+    在這台主機上實際跑一次每個模型 × -t × -p 的組合，記錄即時率 (RTF = 轉錄耗時 / 音訊長度)。
+    只取 sample_audio 的前 clip_sec 秒來測，並略過 threads × processors 超過 CPU 核心數的組合。
+    """
+    executable_path, _ = get_whisper_paths("base")
+    if not os.path.exists(executable_path):
+        print(f"❌ 錯誤：找不到 whisper.cpp 執行檔於 '{executable_path}'")
+        return None
+
+    models = models or list_available_models()
+    if not models:
+        print("❌ 錯誤：找不到任何 ggml-*.bin 模型。")
+        return None
+
+    cpu_count = os.cpu_count() or 1
+    thread_options = thread_options or _default_thread_options()
+    combos = [(t, p) for t in thread_options for p in processor_options if t * p <= cpu_count]
+
+    results = []
+    with tempfile.TemporaryDirectory(prefix="whisper_calibrate_") as tmp_dir:
+        clip_path = os.path.join(tmp_dir, "clip.wav")
+        try:
+            subprocess.run(
+                ["ffmpeg", "-loglevel", "error", "-y", "-i", sample_audio, "-t", str(clip_sec),
+                 "-ar", "16000", "-ac", "1", clip_path],
+                check=True,
+            )
+        except (FileNotFoundError, subprocess.CalledProcessError) as e:
+            print(f"❌ 無法用 ffmpeg 擷取測試片段：{e}")
+            return None
+        actual_clip_sec = get_audio_duration(clip_path) or clip_sec
+
+        print(f"\n🧪 開始校準：{len(models)} 個模型 × {len(combos)} 種設定，測試片段 {actual_clip_sec:.0f} 秒")
+        for model in models:
+            _, model_path = get_whisper_paths(model)
+            for threads, processors in combos:
+                command = [
+                    executable_path,
+                    "-m", model_path,
+                    "-f", clip_path,
+                    "-l", "auto",
+                    "-t", str(threads),
+                    "-p", str(processors),
+                    "-np",
+                ]
+                start_time = time.time()
+                try:
+                    subprocess.run(command, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+                except subprocess.CalledProcessError as e:
+                    print(f"  ⚠️ {model} -t {threads} -p {processors} 執行失敗 (錯誤碼 {e.returncode})，略過。")
+                    continue
+                rtf = (time.time() - start_time) / actual_clip_sec
+                results.append({"model": model, "threads": threads, "processors": processors, "rtf": rtf})
+                print(f"  ⏱️ {model:<16} -t {threads:<2} -p {processors}：RTF {rtf:.3f}")
+
+    calibration = {
+        "calibrated_at": time.time(),
+        "cpu_count": cpu_count,
+        "clip_sec": actual_clip_sec,
+        "results": results,
+    }
+
+    all_hosts = {}
+    if os.path.exists(CALIBRATION_FILE):
+        try:
+            with open(CALIBRATION_FILE, 'r', encoding='utf-8') as f:
+                all_hosts = json.load(f)
+        except (OSError, json.JSONDecodeError):
+            all_hosts = {}
+    all_hosts[socket.gethostname()] = calibration
+    os.makedirs(os.path.dirname(CALIBRATION_FILE), exist_ok=True)
+    with open(CALIBRATION_FILE, 'w', encoding='utf-8') as f:
+        json.dump(all_hosts, f, ensure_ascii=False, indent=4)
+    print(f"\n💾 校準結果已儲存至：{CALIBRATION_FILE}")
+    return calibration
+
+
+def choose_whisper_settings(duration_sec=None, deadline_sec=None, target_rtf=None):
+    """
+    依校準結果挑出「在期限內跑得完的最準模型」與其最快的 -t / -p 設定。
+    deadline_sec 需要搭配 duration_sec (整集長度) 使用；兩者都沒給時以 DEFAULT_TARGET_RTF 為準。
+    如果沒有任何模型跑得完，就退而求其次選最快的組合。沒有校準資料時回傳 None。
+    """
+    calibration = load_calibration()
+    if not calibration or not calibration.get("results"):
+        return None
+
+    allowed_rtf = target_rtf
+    if deadline_sec and duration_sec:
+        deadline_rtf = deadline_sec / duration_sec
+        allowed_rtf = deadline_rtf if allowed_rtf is None else min(allowed_rtf, deadline_rtf)
+    if allowed_rtf is None:
+        allowed_rtf = DEFAULT_TARGET_RTF
+
+    # 只考慮這台主機上目前還存在的模型 (舊的校準結果裡可能有 *.en 模型，預設也會在這裡被排除)
+    available = set(list_available_models())
+    results = [r for r in calibration["results"] if r["model"] in available]
+    if not results:
+        return None
+
+    fitting = [r for r in results if r["rtf"] <= allowed_rtf]
+    if fitting:
+        best = max(fitting, key=lambda r: (model_accuracy_rank(r["model"]), -r["rtf"]))
+    else:
+        best = min(results, key=lambda r: r["rtf"])
+        print(f"⚠️ 警告：沒有任何模型能達到 RTF {allowed_rtf:.2f}，改用最快的 {best['model']}。")
+
+    selection = dict(best)
+    selection["allowed_rtf"] = allowed_rtf
+    if duration_sec:
+        selection["estimated_sec"] = best["rtf"] * duration_sec
+    return selection
+
+
+if __name__ == "__main__":
+    sample = input("請輸入用來校準的音檔路徑：\n> ").strip()
+    if not os.path.exists(sample):
+        print(f"❌ 錯誤：找不到檔案 '{sample}'。")
+    else:
+        calibrate(sample)
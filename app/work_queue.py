@@ -0,0 +1,429 @@
+import os
+import sys
+import json
+import random
+import socket
+import hashlib
+import argparse
+import threading
+import time
+import uuid
+
+from dedup_index import is_original_mp3, relink_duplicates
+from run_whisper_cpp import is_transcript_complete
+
+# 工作佇列直接放在共用的 podcast_downloads 裡 (例如 NFS 掛載點)，不需要額外的 broker。
+# 所有的「搶鎖」都只依賴 O_CREAT|O_EXCL 與 rename 這兩個在 NFS 上也是原子性的操作。
+# 注意：租約到期時間用的是各節點的系統時間，請確認所有節點都有跑 NTP。
+BASE_DIR = "podcast_downloads"
+QUEUE_DIR = os.path.join(BASE_DIR, ".queue")
+
+LEASE_TTL = 120            # 租約有效秒數；工作者當機後最久這麼久會被其他節點接手
+HEARTBEAT_INTERVAL = 30    # 心跳 (續約) 間隔
+POLL_INTERVAL = 10         # 沒工作時多久再找一次
+MAX_ATTEMPTS = 3           # 同一個工作最多失敗幾次就不再重試
+
+
+def _run_transcribe(episode_path, worker):
+    from stream_transcribe import stream_transcribe_file
+    return stream_transcribe_file(episode_path, model_size=worker.whisper_model)
+
+
+def _run_analyze(episode_path, worker):
+    from google_API import analyze_transcript_with_google_api
+    analyze_transcript_with_google_api(episode_path + ".json")
+    return os.path.exists(episode_path + ".analysis.json")
+
+
+# 每個階段：需要的能力、是否已完成、前置條件、完成後要接著排入的階段
+# 逐字稿在串流轉錄期間就已經存在 (內容不完整)，所以「完成」要看有沒有 .inprogress 標記，而不是檔案在不在
+STAGES = {
+    "transcribe": {
+        "requires": "whisper_local",
+        "done": lambda ep: is_transcript_complete(ep + ".json"),
+        "ready": lambda ep: os.path.exists(ep),
+        "run": _run_transcribe,
+        "next": "analyze",
+    },
+    "analyze": {
+        "requires": "gemini",
+        "done": lambda ep: os.path.exists(ep + ".analysis.json"),
+        "ready": lambda ep: is_transcript_complete(ep + ".json"),
+        "run": _run_analyze,
+        "next": None,
+    },
+}
+
+
+def detect_capabilities(whisper_model="base"):
+    """
+    偵測這個節點能做哪些工作。可用環境變數 WORKER_CAPABILITIES (逗號分隔) 直接覆寫，
+    例如只跑雲端 API 的節點可以設成 "gemini"。
+    """
+    override = os.getenv("WORKER_CAPABILITIES")
+    if override is not None:
+        return sorted(c.strip() for c in override.split(",") if c.strip())
+
+    from dotenv import load_dotenv
+    from run_whisper_cpp import get_whisper_paths
+    load_dotenv()
+
+    capabilities = []
+    if whisper_model == "auto":
+        from whisper_tuning import choose_whisper_settings
+        settings = choose_whisper_settings()
+        whisper_model = settings["model"] if settings else "base"
+    executable_path, model_path = get_whisper_paths(whisper_model)
+    if os.path.exists(executable_path) and os.path.exists(model_path):
+        capabilities.append("whisper_local")
+    if os.getenv("GOOGLE_API_KEY"):
+        capabilities.append("gemini")
+    if os.getenv("GROQ_API_KEY"):
+        capabilities.append("groq")
+    return capabilities
+
+
+def _task_id(stage, episode_rel):
+    return f"{stage}--{hashlib.sha1(episode_rel.encode('utf-8')).hexdigest()[:16]}"
+
+
+def _read_json(path):
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return None
+
+
+def _write_json_atomic(path, data):
+    tmp_path = f"{path}.{socket.gethostname()}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+
+
+def _create_exclusive(path, data):
+    """只有在檔案不存在時才建立；建立成功回傳 True。"""
+    try:
+        fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644)
+    except FileExistsError:
+        return False
+    with os.fdopen(fd, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+    return True
+
+
+def _lease_expires(lease_path):
+    """
+    讀取租約的到期時間。檔案剛被建立、內容還沒寫完時讀不到 JSON，
+    這時以檔案的修改時間推算，避免把別人剛搶到的租約誤判為過期。
+    """
+    lease = _read_json(lease_path)
+    if lease is not None:
+        return lease.get("expires", 0)
+    try:
+        return os.path.getmtime(lease_path) + LEASE_TTL
+    except FileNotFoundError:
+        return 0
+
+
+class WorkQueue:
+    """以檔案系統實作的工作佇列：tasks/ 放工作，leases/ 放租約，done/ 放完成紀錄，workers/ 放節點心跳。"""
+
+    def __init__(self, queue_dir=QUEUE_DIR, base_dir=BASE_DIR):
+        self.base_dir = base_dir
+        self.queue_dir = queue_dir
+        self.tasks_dir = os.path.join(queue_dir, "tasks")
+        self.leases_dir = os.path.join(queue_dir, "leases")
+        self.done_dir = os.path.join(queue_dir, "done")
+        self.workers_dir = os.path.join(queue_dir, "workers")
+        for d in (self.tasks_dir, self.leases_dir, self.done_dir, self.workers_dir):
+            os.makedirs(d, exist_ok=True)
+
+    # --- 工作 ---
+
+    def enqueue(self, stage, episode_path):
+        """排入一個工作；同一集同一階段只會有一份，重複排入不會有副作用。"""
+        episode_rel = os.path.relpath(episode_path, self.base_dir)
+        task_id = _task_id(stage, episode_rel)
+        if os.path.exists(os.path.join(self.done_dir, task_id + ".json")):
+            return None
+        task = {
+            "id": task_id,
+            "stage": stage,
+            "episode": episode_rel,
+            "requires": STAGES[stage]["requires"],
+            "created": time.time(),
+        }
+        if _create_exclusive(os.path.join(self.tasks_dir, task_id + ".json"), task):
+            return task_id
+        return None
+
+    def enqueue_library(self):
+        """掃描整個資料庫，把還缺逐字稿或分析結果的集數排入佇列。"""
+        count = 0
+        for root, dirs, files in os.walk(self.base_dir):
+            # 不要掃進佇列本身或其他隱藏資料夾
+            dirs[:] = [d for d in dirs if not d.startswith(".")]
+            for file_name in files:
+                episode_path = os.path.join(root, file_name)
+                # 符號連結是去重後指向正本的重複集數，由正本負責處理
+                if not is_original_mp3(file_name) or os.path.islink(episode_path):
+                    continue
+                # 只排入第一個還沒完成的階段，後續階段由工作者完成後接力排入
+                for stage, spec in STAGES.items():
+                    if spec["done"](episode_path):
+                        continue
+                    if spec["ready"](episode_path) and self.enqueue(stage, episode_path):
+                        count += 1
+                    break
+        return count
+
+    def list_tasks(self):
+        tasks = []
+        for file_name in os.listdir(self.tasks_dir):
+            if file_name.endswith(".json"):
+                task = _read_json(os.path.join(self.tasks_dir, file_name))
+                if task:
+                    tasks.append(task)
+        return tasks
+
+    def mark_done(self, task, worker_id, ok):
+        record = {"worker": worker_id, "finished": time.time(), "ok": ok}
+        if ok:
+            _write_json_atomic(os.path.join(self.done_dir, task["id"] + ".json"), record)
+            try:
+                os.remove(os.path.join(self.tasks_dir, task["id"] + ".json"))
+            except FileNotFoundError:
+                pass
+        else:
+            # 失敗的工作留在佇列裡，記錄失敗次數後交給其他節點重試
+            task["failures"] = task.get("failures", 0) + 1
+            task["last_error_worker"] = worker_id
+            _write_json_atomic(os.path.join(self.tasks_dir, task["id"] + ".json"), task)
+
+    # --- 租約 ---
+
+    def _lease_path(self, task_id):
+        return os.path.join(self.leases_dir, task_id + ".lease")
+
+    def try_claim(self, task_id, worker_id):
+        """嘗試取得工作的租約。租約已過期 (原本的工作者當機) 時會先回收再搶。"""
+        lease_path = self._lease_path(task_id)
+        lease = {"worker": worker_id, "token": uuid.uuid4().hex, "expires": time.time() + LEASE_TTL}
+        if _create_exclusive(lease_path, lease):
+            return lease
+
+        if _lease_expires(lease_path) > time.time():
+            return None
+
+        # 把過期的租約改名移走；rename 是原子性的，同時只會有一個節點成功
+        stale_path = f"{lease_path}.stale-{worker_id}-{uuid.uuid4().hex[:8]}"
+        try:
+            os.rename(lease_path, stale_path)
+        except FileNotFoundError:
+            return None
+        moved = _read_json(stale_path)
+        if _lease_expires(stale_path) > time.time():
+            # 在讀取與改名之間已經有別人搶到新租約了，放回去
+            try:
+                os.link(stale_path, lease_path)
+            except FileExistsError:
+                pass
+            os.remove(stale_path)
+            return None
+        os.remove(stale_path)
+        if moved is not None:
+            print(f"♻️ 回收工作者 '{moved.get('worker')}' 已過期的工作 {task_id}")
+
+        if _create_exclusive(lease_path, lease):
+            return lease
+        return None
+
+    def renew(self, task_id, lease):
+        """續約。若租約已經被別人回收則回傳 False。"""
+        lease_path = self._lease_path(task_id)
+        current = _read_json(lease_path)
+        if current is None or current.get("token") != lease["token"]:
+            return False
+        lease["expires"] = time.time() + LEASE_TTL
+        _write_json_atomic(lease_path, lease)
+        return True
+
+    def release(self, task_id, lease):
+        lease_path = self._lease_path(task_id)
+        current = _read_json(lease_path)
+        if current is not None and current.get("token") == lease["token"]:
+            try:
+                os.remove(lease_path)
+            except FileNotFoundError:
+                pass
+
+    # --- 節點 ---
+
+    def advertise(self, worker_id, info):
+        _write_json_atomic(os.path.join(self.workers_dir, worker_id + ".json"), info)
+
+    def retire(self, worker_id):
+        try:
+            os.remove(os.path.join(self.workers_dir, worker_id + ".json"))
+        except FileNotFoundError:
+            pass
+
+    def list_workers(self):
+        workers = []
+        for file_name in os.listdir(self.workers_dir):
+            if file_name.endswith(".json"):
+                info = _read_json(os.path.join(self.workers_dir, file_name))
+                if info:
+                    info["alive"] = info.get("heartbeat", 0) + LEASE_TTL > time.time()
+                    workers.append(info)
+        return workers
+
+
+class Worker:
+    """一個工作者行程：找出符合自身能力的工作、搶租約、執行、持續心跳直到完成。"""
+
+    def __init__(self, work_queue, capabilities=None, whisper_model="base", worker_id=None):
+        self.queue = work_queue
+        self.whisper_model = whisper_model
+        self.capabilities = capabilities if capabilities is not None else detect_capabilities(whisper_model)
+        self.worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}"
+        self.current = None  # (task_id, lease)
+        self.completed = 0
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+
+    def _advertise(self):
+        with self._lock:
+            current_task = self.current[0] if self.current else None
+        self.queue.advertise(self.worker_id, {
+            "id": self.worker_id,
+            "host": socket.gethostname(),
+            "pid": os.getpid(),
+            "capabilities": self.capabilities,
+            "whisper_model": self.whisper_model,
+            "current_task": current_task,
+            "completed": self.completed,
+            "heartbeat": time.time(),
+        })
+
+    def _heartbeat_loop(self):
+        while not self._stop.wait(HEARTBEAT_INTERVAL):
+            self._advertise()
+            with self._lock:
+                current = self.current
+            if current and not self.queue.renew(*current):
+                print(f"⚠️ 警告：工作 {current[0]} 的租約已被其他節點回收。")
+
+    def _find_and_claim(self):
+        tasks = self.queue.list_tasks()
+        # 打亂順序，讓多個節點不會總是搶同一個工作
+        random.shuffle(tasks)
+        for task in tasks:
+            if task["requires"] not in self.capabilities or task.get("failures", 0) >= MAX_ATTEMPTS:
+                continue
+            if os.path.exists(os.path.join(self.queue.done_dir, task["id"] + ".json")):
+                continue
+            lease = self.queue.try_claim(task["id"], self.worker_id)
+            if lease:
+                return task, lease
+        return None, None
+
+    def run_task(self, task, lease):
+        spec = STAGES[task["stage"]]
+        episode_path = os.path.join(self.queue.base_dir, task["episode"])
+        print(f"\n🔧 [{self.worker_id}] {task['stage']}：{task['episode']}")
+
+        with self._lock:
+            self.current = (task["id"], lease)
+        try:
+            if spec["done"](episode_path):
+                # 其他節點 (或手動執行) 已經做完了
+                ok = True
+            elif not spec["ready"](episode_path):
+                print(f"  ⚠️ 警告：前置檔案不存在，略過。")
+                ok = False
+            else:
+                try:
+                    ok = bool(spec["run"](episode_path, self))
+                except Exception as e:
+                    print(f"  ❌ 執行工作時發生錯誤：{e}")
+                    ok = False
+            self.queue.mark_done(task, self.worker_id, ok)
+            if ok:
+                self.completed += 1
+                # 重複集數不會被排入佇列，靠正本每完成一個階段就把新檔案連結過去
+                relink_duplicates(episode_path, base_dir=self.queue.base_dir)
+                if spec["next"]:
+                    self.queue.enqueue(spec["next"], episode_path)
+                else:
+                    # 整集處理完之後檢查容量 (有 .storage.json 設定檔時才會動作)
+                    from storage_manager import enforce_storage_budget
+                    enforce_storage_budget(quiet=True)
+        finally:
+            with self._lock:
+                self.current = None
+            self.queue.release(task["id"], lease)
+        return ok
+
+    def run(self, once=False):
+        print(f"👷 工作者 '{self.worker_id}' 啟動，能力：{', '.join(self.capabilities) or '(無)'}")
+        self._advertise()
+        heartbeat = threading.Thread(target=self._heartbeat_loop, daemon=True)
+        heartbeat.start()
+        try:
+            while not self._stop.is_set():
+                task, lease = self._find_and_claim()
+                if task is None:
+                    if once:
+                        break
+                    self._stop.wait(POLL_INTERVAL * random.uniform(0.5, 1.5))
+                    continue
+                self.run_task(task, lease)
+        except KeyboardInterrupt:
+            print(f"\n👋 工作者 '{self.worker_id}' 結束。")
+        finally:
+            self._stop.set()
+            self.queue.retire(self.worker_id)
+
+    def stop(self):
+        self._stop.set()
+
+
+def print_status(work_queue):
+    tasks = work_queue.list_tasks()
+    leased = {f[:-len(".lease")] for f in os.listdir(work_queue.leases_dir) if f.endswith(".lease")}
+    done = len([f for f in os.listdir(work_queue.done_dir) if f.endswith(".json")])
+    print(f"📋 待處理：{len([t for t in tasks if t['id'] not in leased])}，進行中：{len(leased)}，已完成：{done}")
+    for info in work_queue.list_workers():
+        status = "🟢" if info["alive"] else "🔴"
+        print(f"  {status} {info['id']} [{', '.join(info['capabilities'])}] 完成 {info['completed']} 件，"
+              f"目前：{info['current_task'] or '閒置'}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="多節點共用的 podcast 處理佇列")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("enqueue", help="掃描 podcast_downloads 並排入缺少的工作")
+    worker_parser = sub.add_parser("worker", help="啟動一個工作者")
+    worker_parser.add_argument("--model", default="base", help="本機 whisper.cpp 模型大小，auto 表示依校準結果自動選擇")
+    worker_parser.add_argument("--capabilities", help="以逗號分隔，覆寫自動偵測的能力")
+    worker_parser.add_argument("--once", action="store_true", help="佇列清空後就結束")
+    sub.add_parser("status", help="顯示佇列與工作者狀態")
+    args = parser.parse_args(argv)
+
+    work_queue = WorkQueue()
+    if args.command == "enqueue":
+        print(f"✅ 已排入 {work_queue.enqueue_library()} 個新工作。")
+    elif args.command == "worker":
+        capabilities = None
+        if args.capabilities is not None:
+            capabilities = [c.strip() for c in args.capabilities.split(",") if c.strip()]
+        Worker(work_queue, capabilities=capabilities, whisper_model=args.model).run(once=args.once)
+    elif args.command == "status":
+        print_status(work_queue)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,42 @@
+import os
+import subprocess
+import sys
+import time
+
+# 各功能模組的 SDK 都應該在真正用到時才載入 (見 app/cli.py 開頭的說明)。
+# 這裡在獨立的子行程裡匯入 CLI 與所有功能模組，確認沒有任何一個偷偷在匯入時就載入 SDK，
+# 並限制 `python -m app --help` 的啟動時間，避免之後有人把重量級的 import 放回檔案開頭。
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+HEAVY_SDKS = ["google.generativeai", "groq", "openai", "pydub"]
+LAZY_MODULES = [
+    "cli", "google_API", "groq_api", "compress_mp3", "cut_ads", "podcast_downloader",
+    "stream_transcribe", "run_whisper_cpp", "whisper_tuning", "dedup_index",
+    "storage_manager", "work_queue", "subscription_daemon",
+]
+HELP_BUDGET_SEC = 1.5
+
+
+def _run(args):
+    return subprocess.run([sys.executable] + args, cwd=REPO_ROOT, capture_output=True, text=True, timeout=60)
+
+
+def test_modules_do_not_import_sdks():
+    code = (
+        "import sys; sys.path.insert(0, 'app')\n"
+        f"for name in {LAZY_MODULES!r}: __import__(name)\n"
+        f"print(','.join(m for m in {HEAVY_SDKS!r} if m in sys.modules))\n"
+    )
+    result = _run(["-c", code])
+    assert result.returncode == 0, result.stderr
+    assert result.stdout.strip() == "", f"匯入時就載入了 SDK：{result.stdout.strip()}"
+
+
+def test_cli_help_startup_budget():
+    # 先跑一次暖身，讓 .pyc 快取就緒，量到的才是實際啟動時間
+    _run(["-m", "app", "--help"])
+    start_time = time.monotonic()
+    result = _run(["-m", "app", "--help"])
+    elapsed = time.monotonic() - start_time
+    assert result.returncode == 0, result.stderr
+    assert elapsed < HELP_BUDGET_SEC, f"python -m app --help 花了 {elapsed:.2f} 秒 (上限 {HELP_BUDGET_SEC} 秒)"
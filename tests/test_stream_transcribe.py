@@ -0,0 +1,118 @@
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "app"))
+
+import stream_transcribe  # noqa: E402
+
+# 邊下載邊轉錄的流程測試：用限速的本機 HTTP 伺服器送出音檔，轉錄端換成假的函式。
+# 測試環境不一定有 ffmpeg，解碼器換成 cat，送進去的位元組直接當成 PCM。
+WINDOW_SEC = 1
+WINDOW_BYTES = WINDOW_SEC * stream_transcribe.SAMPLE_RATE * stream_transcribe.SAMPLE_WIDTH
+AUDIO = os.urandom(WINDOW_BYTES * 3 + WINDOW_BYTES // 2)  # 3.5 個視窗
+CHUNK = 8192
+
+
+class _ThrottledHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        # /broken 在送出一個視窗之後就中斷連線，模擬下載途中斷網
+        broken = self.path == "/broken"
+        body = AUDIO[:WINDOW_BYTES + CHUNK] if broken else AUDIO
+        self.send_response(200)
+        self.send_header("Content-Type", "audio/mpeg")
+        self.send_header("Content-Length", str(len(AUDIO)))
+        self.end_headers()
+        for offset in range(0, len(body), CHUNK):
+            self.wfile.write(body[offset:offset + CHUNK])
+            self.wfile.flush()
+            time.sleep(0.005)
+        if broken:
+            self.close_connection = True
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), _ThrottledHandler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{httpd.server_address[1]}"
+    httpd.shutdown()
+
+
+@pytest.fixture(autouse=True)
+def cat_decoder(monkeypatch, tmp_path):
+    monkeypatch.setattr(stream_transcribe, "_start_decoder",
+                        lambda: subprocess.Popen(["cat"], stdin=subprocess.PIPE, stdout=subprocess.PIPE))
+    # 去重索引寫在工作目錄下的 podcast_downloads
+    monkeypatch.chdir(tmp_path)
+
+
+def _run_with_timeout(func, timeout=30):
+    """在另一條執行緒執行，卡住時讓測試失敗而不是整個測試程序停住。"""
+    result = {}
+    thread = threading.Thread(target=lambda: result.setdefault("value", func()), daemon=True)
+    thread.start()
+    thread.join(timeout)
+    assert not thread.is_alive(), "串流流程卡住了"
+    return result["value"]
+
+
+def test_segments_get_absolute_offsets_and_json_grows(server, tmp_path):
+    save_path = str(tmp_path / "episode.mp3")
+    json_path = save_path + ".json"
+    seen_lengths = []
+
+    def transcribe_window(wav_path):
+        # 轉錄下一個視窗時，前面的視窗應該已經寫進逐字稿
+        with open(json_path, 'r', encoding='utf-8') as f:
+            seen_lengths.append(len(json.load(f)))
+        assert os.path.exists(stream_transcribe.transcript_marker_path(json_path))
+        return [{"start": 0.25, "end": 0.75, "text": f"window {len(seen_lengths)}"}]
+
+    ok = _run_with_timeout(lambda: stream_transcribe.stream_download_and_transcribe(
+        server + "/episode.mp3", save_path, window_sec=WINDOW_SEC, transcribe_window=transcribe_window))
+
+    assert ok is True
+    assert seen_lengths == [0, 1, 2, 3]
+    with open(json_path, 'r', encoding='utf-8') as f:
+        segments = json.load(f)
+    assert [seg["start"] for seg in segments] == [0.25, 1.25, 2.25, 3.25]
+    assert [seg["end"] for seg in segments] == [0.75, 1.75, 2.75, 3.75]
+    with open(save_path, 'rb') as f:
+        assert f.read() == AUDIO
+    assert stream_transcribe.is_transcript_complete(json_path)
+
+
+def test_mid_stream_failure_cleans_up_without_hanging(server, tmp_path):
+    save_path = str(tmp_path / "episode.mp3")
+    ok = _run_with_timeout(lambda: stream_transcribe.stream_download_and_transcribe(
+        server + "/broken", save_path, window_sec=WINDOW_SEC, transcribe_window=lambda wav_path: []))
+
+    assert ok is False
+    assert not os.path.exists(save_path)
+    assert not os.path.exists(save_path + ".json")
+    assert not os.path.exists(stream_transcribe.transcript_marker_path(save_path + ".json"))
+
+
+def test_transcriber_error_stops_bounded_file_mode(tmp_path):
+    audio_path = str(tmp_path / "episode.mp3")
+    with open(audio_path, 'wb') as f:
+        f.write(AUDIO * 4)
+
+    def failing_window(wav_path):
+        raise RuntimeError("whisper crashed")
+
+    ok = _run_with_timeout(lambda: stream_transcribe.stream_transcribe_file(
+        audio_path, window_sec=WINDOW_SEC, transcribe_window=failing_window))
+    assert ok is False
+    assert not os.path.exists(audio_path + ".json")
@@ -0,0 +1,121 @@
+import json
+import multiprocessing
+import os
+import sys
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "app"))
+
+import work_queue  # noqa: E402
+
+# 多個本機工作者行程共用同一個佇列資料夾，模擬多個節點掛載同一個 podcast_downloads。
+# 各階段換成只寫出結果檔的假工作，並把每次執行記到 runs.log，用來檢查有沒有同一個工作被做兩次。
+EPISODES = 40
+WORKERS = 4
+CAPABILITIES = ["whisper_local", "gemini"]
+
+
+def _log_run(stage, episode_path):
+    # O_APPEND 的單次 write 不會跟其他行程交錯
+    fd = os.open("runs.log", os.O_WRONLY | os.O_APPEND | os.O_CREAT)
+    try:
+        os.write(fd, f"{stage}\t{episode_path}\n".encode("utf-8"))
+    finally:
+        os.close(fd)
+
+
+def _fake_transcribe(episode_path, worker):
+    _log_run("transcribe", episode_path)
+    time.sleep(0.01)
+    with open(episode_path + ".json", 'w', encoding='utf-8') as f:
+        json.dump([{"start": 0.0, "end": 1.0, "text": "hello"}], f)
+    return True
+
+
+def _fake_analyze(episode_path, worker):
+    _log_run("analyze", episode_path)
+    with open(episode_path + ".analysis.json", 'w', encoding='utf-8') as f:
+        json.dump({"ads": []}, f)
+    return True
+
+
+@pytest.fixture
+def library(monkeypatch, tmp_path):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setitem(work_queue.STAGES["transcribe"], "run", _fake_transcribe)
+    monkeypatch.setitem(work_queue.STAGES["analyze"], "run", _fake_analyze)
+    base_dir = "podcast_downloads"
+    os.makedirs(os.path.join(base_dir, "Show"))
+    for i in range(EPISODES):
+        with open(os.path.join(base_dir, "Show", f"episode {i:02d}.mp3"), 'wb') as f:
+            f.write(b"\0" * 16)
+    return base_dir
+
+
+def _queue(base_dir):
+    return work_queue.WorkQueue(queue_dir=os.path.join(base_dir, ".queue"), base_dir=base_dir)
+
+
+def _run_worker(base_dir, worker_id):
+    work_queue.Worker(_queue(base_dir), capabilities=CAPABILITIES, worker_id=worker_id).run(once=True)
+
+
+def _runs():
+    if not os.path.exists("runs.log"):
+        return []
+    with open("runs.log", 'r', encoding='utf-8') as f:
+        return [tuple(line.rstrip("\n").split("\t")) for line in f]
+
+
+@pytest.mark.skipif("fork" not in multiprocessing.get_all_start_methods(), reason="需要 fork 才能沿用替換過的階段")
+def test_workers_process_every_task_exactly_once(library):
+    assert _queue(library).enqueue_library() == EPISODES
+
+    context = multiprocessing.get_context("fork")
+    workers = [context.Process(target=_run_worker, args=(library, f"worker-{i}")) for i in range(WORKERS)]
+    for process in workers:
+        process.start()
+    for process in workers:
+        process.join(60)
+        assert process.exitcode == 0
+
+    runs = _runs()
+    assert len(runs) == len(set(runs)), "有工作被重複執行"
+    assert sorted(runs) == sorted((stage, os.path.join(library, "Show", f"episode {i:02d}.mp3"))
+                                  for stage in ("transcribe", "analyze") for i in range(EPISODES))
+    queue = _queue(library)
+    assert queue.list_tasks() == []
+    assert os.listdir(queue.leases_dir) == []
+
+
+def test_expired_lease_is_reclaimed(library):
+    queue = _queue(library)
+    episode_path = os.path.join(library, "Show", "episode 00.mp3")
+    task_id = queue.enqueue("transcribe", episode_path)
+
+    # 另一個節點搶到租約之後就當機了：租約還在，但早已過期
+    with open(queue._lease_path(task_id), 'w', encoding='utf-8') as f:
+        json.dump({"worker": "dead-node", "token": "x", "expires": time.time() - 1}, f)
+    # 當機前已經寫了一半的逐字稿，不能被當成完成
+    with open(episode_path + ".json", 'w', encoding='utf-8') as f:
+        json.dump([], f)
+    open(episode_path + ".json.inprogress", 'w').close()
+
+    work_queue.Worker(queue, capabilities=["whisper_local"], worker_id="rescuer").run(once=True)
+
+    assert _runs() == [("transcribe", episode_path)]
+    assert os.path.exists(os.path.join(queue.done_dir, task_id + ".json"))
+    assert not os.path.exists(queue._lease_path(task_id))
+
+
+def test_live_lease_is_not_stolen(library):
+    queue = _queue(library)
+    task_id = queue.enqueue("transcribe", os.path.join(library, "Show", "episode 00.mp3"))
+    with open(queue._lease_path(task_id), 'w', encoding='utf-8') as f:
+        json.dump({"worker": "busy-node", "token": "x", "expires": time.time() + work_queue.LEASE_TTL}, f)
+
+    assert queue.try_claim(task_id, "other") is None
+    work_queue.Worker(queue, capabilities=["whisper_local"], worker_id="other").run(once=True)
+    assert _runs() == []